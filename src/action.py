@@ -1,16 +1,30 @@
 import logging
 import json
 import os
-import requests
+import threading
+import typing
 
 from src.loadable import Loadable, type_choice, type_list_of_type
 from src.context import Context
+from src.session import init_session
 
 logger = logging.getLogger(__name__)
 
 class ActionException(Exception):
     pass
 
+def substitute(obj: typing.Any, placeholder: str, value: str) -> typing.Any:
+    """
+    Replace `placeholder` with `value` in all strings, including dictionary keys, of a JSON compatible structure
+    """
+    if isinstance(obj, str):
+        return obj.replace(placeholder, value)
+    elif isinstance(obj, list):
+        return [substitute(x, placeholder, value) for x in obj]
+    elif isinstance(obj, dict):
+        return {substitute(k, placeholder, value) : substitute(v, placeholder, value) for k, v in obj.items()}
+    return obj
+
 class Action(Loadable):
     def report(self, ctx: Context, data: dict) -> None:
         raise ActionException("Not Implemented")
@@ -24,12 +38,18 @@ class LogAction(Action):
         "error_level" : (type_choice(["debug", "info", "warning", "error", "critical"], default="error"), "error"),
     }
 
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Bind the log level methods once rather than resolving them per report
+        self.log = getattr(logger, self.level)
+        self.log_error = getattr(logger, self.error_level)
+
     def report(self, ctx: Context, data: dict) -> None:
         comment = "\n\t" + "\n\t".join((data.get("comment") or data.get("data")).split("\n"))
-        getattr(logger, self.level)(f"Comment: {comment}")
+        self.log(f"Comment: {comment}")
     
     def error(self, ctx: Context, data: dict) -> None:
-        getattr(logger, self.error_level)(data.get("error"))
+        self.log_error(data.get("error"))
 
 class FileLogAction(LogAction):
     default_key = "file"
@@ -37,6 +57,8 @@ class FileLogAction(LogAction):
         "file" : (str, "swatch.log")
     }
     loggers = {}
+    # Serializes creating loggers, as watch files may be processed concurrently
+    loggers_lock = threading.Lock()
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -48,7 +70,14 @@ class FileLogAction(LogAction):
         # Have to create the logger lazily, as we don't have access to the context in __init__
         if logname in FileLogAction.loggers:
             return FileLogAction.loggers.get(logname)
-        
+
+        with FileLogAction.loggers_lock:
+            # Check again under the lock, another thread may have created the logger while waiting
+            if logname in FileLogAction.loggers:
+                return FileLogAction.loggers.get(logname)
+            return self.create_logger(ctx, logname)
+
+    def create_logger(self, ctx: Context, logname: str) -> logging.Logger:
         log_path = os.path.join(ctx.get_variable("base_dir"), ctx.get_variable("config").get("data_path", "data"))
         os.makedirs(log_path, exist_ok=True)
         
@@ -64,16 +93,16 @@ class FileLogAction(LogAction):
         return logger
 
     def report(self, ctx: Context, data: dict) -> None:
-        logger = self.get_logger(ctx)
+        log = getattr(self.get_logger(ctx), self.level)
 
         for line in data.get("comment").splitlines():
-            getattr(logger, self.level)(line)
+            log(line)
     
     def error(self, ctx: Context, data: dict) -> None:
-        logger = self.get_logger(ctx)
+        log = getattr(self.get_logger(ctx), self.error_level)
         
         for line in data.get("error").splitlines():
-            getattr(logger, self.error_level)(line)
+            log(line)
 
 class SlackAction(Action):
     keys = {
@@ -82,12 +111,9 @@ class SlackAction(Action):
     }
     
     def run(self, message: str) -> None:
-        data = json.dumps(self.payload).replace("MESSAGE", json.dumps(message).strip('"'))
-        r = requests.request(
-            "POST",
+        init_session().post(
             self.url,
-            headers={"content-type" : "application/json"},
-            data=data.encode()
+            json=substitute(self.payload, "MESSAGE", message if isinstance(message, str) else json.dumps(message))
         )
 
     def report(self, ctx: Context, data: dict) -> None:
@@ -103,33 +129,49 @@ class RenderAction(Action):
         "id" : (str, "id"),     # Name of the `id` field in the resulting json
         "sort" : (type_list_of_type(str), False)
     }
+    render_paths = set()
+    # Serializes read-modify-write of the render files, as watch files may be processed concurrently
+    render_lock = threading.Lock()
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.name = os.path.split(self.name)[-1] + ".json"
 
     def report(self, ctx: Context, data: dict) -> None:
+        with RenderAction.render_lock:
+            self.update_render_file(ctx, data)
+
+    def update_render_file(self, ctx: Context, data: dict) -> None:
         render_path = os.path.join(ctx.get_variable("base_dir"), ctx.get_variable("config").get("data_path", "data"))
-        os.makedirs(render_path, exist_ok=True)
+        # Only create each render directory once per process
+        if not render_path in RenderAction.render_paths:
+            os.makedirs(render_path, exist_ok=True)
+            RenderAction.render_paths.add(render_path)
 
         render_data = []
         render_path = os.path.join(render_path, self.name)
-        if os.path.isfile(render_path):
-            with open(render_path, "r") as f:
+        try:
+            with open(render_path, "r", encoding="utf-8") as f:
                 render_data = json.load(f)
+        except FileNotFoundError:
+            pass
+
+        # Index the existing entries by id, keeping the first entry for any duplicated id
+        index = {}
+        for i, rdata in enumerate(render_data):
+            index.setdefault(rdata[self.id], i)
 
         # Add or replace the data entries
         for datum in data.get("data", []):
-            found = False
-            for i, rdata in enumerate(render_data):
-                if datum[self.id] == rdata[self.id]:
-                    render_data[i] = datum
-                    found = True
-                    break
-            if not found:
+            i = index.get(datum[self.id])
+            if i is None:
+                index[datum[self.id]] = len(render_data)
                 render_data.append(datum)
+            else:
+                render_data[i] = datum
         
-        for key in self.sort or [self.id]:
-            render_data.sort(key=lambda x: x.get(key))
-        with open(render_path, "w") as f:
-            json.dump(render_data, f, indent=4)
\ No newline at end of file
+        # Sort once on a composite key, equivalent to successive stable sorts on each key where the last key has precedence
+        keys = list(reversed(self.sort or [self.id]))
+        render_data.sort(key=lambda x: tuple(x.get(k) for k in keys))
+        with open(render_path, "w", encoding="utf-8") as f:
+            json.dump(render_data, f, indent=4, ensure_ascii=False)
\ No newline at end of file
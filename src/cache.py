@@ -1,21 +1,52 @@
 import base64
+import functools
+import gzip
 import hashlib
+import io
 import json
 import os
 import re
-import shutil
-import subprocess
-import tempfile
+import struct
+import tarfile
+import threading
+import time
 import typing
 import yaml
 
-from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
-KEY_EXPR = r"^[A-Za-z0-9_-]+$"
+# Prefer the libyaml backed loader when PyYAML has been built with libyaml support
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+FILES_NAME = "files"
+SNAPSHOT_NAME = "cache.json"
+LEGACY_SNAPSHOT_NAME = "cache.yaml"
+CHANGES_NAME = "changes.log"
+LEGACY_FILE_EXPR = re.compile(r"^[0-9a-f]{64}$")
+FILE_HEADER = struct.Struct(">64sQ")
+JSON_SEPARATORS = (",", ":")
+IO_BUFFER_SIZE = 1024 * 1024
+COMPRESS_LEVEL = 1
+NONCE_SIZE = 12
+AESGCM_KEY_INFO = b"swatch-cache-aesgcm"
 
 class CacheException(Exception):
     pass
 
+@functools.lru_cache(maxsize=4096)
+def hash_key(key: str) -> str:
+    """
+    Hash a cache key, memoized as callers commonly perform a has/get/put sequence against the same key
+    """
+    return hashlib.sha256(key.encode()).hexdigest()
+
 def json_encode(obj: object) -> dict:
     if isinstance(obj, (bytes, bytearray)):
         return {"_base64": True, "data" : base64.b64encode(obj).decode()}
@@ -26,72 +57,209 @@ def json_decode(obj: dict) -> object:
         return base64.b64decode(obj["data"])
     return obj
 
+# Shared encoder and decoder instances, avoiding constructing new ones on every json.dumps/json.loads call with custom arguments
+json_encoder = json.JSONEncoder(default=json_encode, separators=JSON_SEPARATORS)
+json_decoder = json.JSONDecoder(object_hook=json_decode)
+
+def pack_files(files: typing.Dict[str, bytes]) -> bytes:
+    """
+    Pack a dictionary of key hash to file data into a single blob of length prefixed records
+    """
+    records = []
+    for k, v in files.items():
+        # Join headers and data in a single pass rather than concatenating each record
+        records.append(FILE_HEADER.pack(k.encode(), len(v)))
+        records.append(v)
+    return b''.join(records)
+
+def unpack_files(data: bytes) -> typing.Dict[str, bytes]:
+    files = {}
+    offset = 0
+    while offset < len(data):
+        key_hash, length = FILE_HEADER.unpack_from(data, offset)
+        offset += FILE_HEADER.size
+        files[key_hash.decode()] = data[offset:offset + length]
+        offset += length
+    return files
+
 class Cache:
     def __init__(self, cache_path: str=None, encryption_key: bytes=None):
         self.cache_path = cache_path
-        self.cache_dir = tempfile.mkdtemp()
+        # Archive members, held in memory rather than round-tripped through a temporary directory
+        self.members = {}
         self.cache = {}
         self.closed = False
-        self.encryptor = Fernet(encryption_key) if encryption_key is not None else None
+        # Track whether the cache has been modified, allowing an unchanged cache archive to be left in place
+        self.dirty = False
+        # Decrypted file data, stored in the archive as a single blob to amortize encryption over all files.
+        # Loaded on first use, so runs which only access entries skip decryption entirely
+        self._files = None
+        # Entries changed since the cache was opened, appended to the changes log rather than rewriting the snapshot
+        self.changes = {}
+        # Number of entries in the snapshot and changes log, used to decide when to compact the log into the snapshot
+        self.snapshot_size = 0
+        self.log_size = 0
+        self.encryption_key = encryption_key
+        self._encryptor = None
+        # Guards cache state, as watch files may be processed concurrently. Callers hold it for read-modify-write sequences of entries
+        self.lock = threading.RLock()
 
-        if self.cache_path is not None and os.path.isfile(self.cache_path):
-            p = subprocess.run(["tar", "-C", self.cache_dir, "-xzf", self.cache_path])
-            if p.returncode != 0:
-                shutil.rmtree(self.cache_dir)
-                raise CacheException("Error extracting cache")
-
-            if os.path.isfile(os.path.join(self.cache_dir, "cache.yaml")):
-                with open(os.path.join(self.cache_dir, "cache.yaml")) as f:
-                    self.cache = yaml.safe_load(f)
+        # Whether the cache archive exists, determined by opening it rather than a separate stat
+        self.exists = False
+        if self.cache_path is not None:
+            try:
+                # Stream the archive through a large buffer rather than seeking around the compressed file
+                with open(self.cache_path, "rb", buffering=IO_BUFFER_SIZE) as f, tarfile.open(fileobj=f, mode="r|gz", bufsize=IO_BUFFER_SIZE) as tf:
+                    for member in tf:
+                        if member.isfile():
+                            self.members[os.path.basename(member.name)] = tf.extractfile(member).read()
+                self.exists = True
+            except FileNotFoundError:
+                pass
+            except (tarfile.TarError, OSError) as e:
+                raise CacheException("Error extracting cache") from e
 
+        if SNAPSHOT_NAME in self.members:
+            self.cache = json_decoder.decode(self.members[SNAPSHOT_NAME].decode())
+        elif LEGACY_SNAPSHOT_NAME in self.members:
+            # Load snapshots from caches written with a yaml manifest
+            self.cache = yaml.load(self.members[LEGACY_SNAPSHOT_NAME], Loader=SafeLoader)
         if not isinstance(self.cache, dict):
             self.cache = {}
+        # A legacy snapshot is treated as empty, so the next write compacts it into a json snapshot
+        self.snapshot_size = len(self.cache) if SNAPSHOT_NAME in self.members else 0
+
+        # Replay changes made since the last snapshot
+        for line in self.members.get(CHANGES_NAME, b'').splitlines():
+            key_hash, data = json_decoder.decode(line.decode())
+            self.cache[key_hash] = data
+            self.log_size += 1
 
     def close(self) -> None:
+        with self.lock:
+            self._close()
+
+    def _close(self) -> None:
         self.closed = True
-        if self.cache_path is not None:
-            with open(os.path.join(self.cache_dir, "cache.yaml"), "w") as f:
-                yaml.dump(self.cache, f, default_flow_style=False)
+        if self.cache_path is not None and (self.dirty or not self.exists):
+            self.flush()
+            if self.log_size + len(self.changes) > 2 * self.snapshot_size:
+                # Compact the changes log into a new snapshot
+                self.members[SNAPSHOT_NAME] = json_encoder.encode(self.cache).encode()
+                self.members.pop(LEGACY_SNAPSHOT_NAME, None)
+                self.members.pop(CHANGES_NAME, None)
+            elif len(self.changes) > 0:
+                self.members[CHANGES_NAME] = self.members.get(CHANGES_NAME, b'') + "".join([
+                    json_encoder.encode([key_hash, data]) + "\n"
+                    for key_hash, data in self.changes.items()
+                ]).encode()
             
-            if not os.path.isdir(os.path.dirname(self.cache_path)):
-                os.makedirs(os.path.dirname(self.cache_path))
-            p = subprocess.run(["tar", "-C", self.cache_dir, "-czf", self.cache_path, "."])
-            
-            shutil.rmtree(self.cache_dir)
-            if p.returncode != 0:
-                raise CacheException("Error compressing cache")
-        else:
-            shutil.rmtree(self.cache_dir)
+            if os.path.dirname(self.cache_path):
+                os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            try:
+                # Compress with a fast level, the cache is rewritten on every changed run and trades little size for the speed
+                with open(self.cache_path, "wb", buffering=IO_BUFFER_SIZE) as f, \
+                        gzip.GzipFile(fileobj=f, mode="wb", compresslevel=COMPRESS_LEVEL) as gf, \
+                        tarfile.open(fileobj=gf, mode="w|", bufsize=IO_BUFFER_SIZE) as tf:
+                    mtime = int(time.time())
+                    for name, data in self.members.items():
+                        info = tarfile.TarInfo("./" + name)
+                        info.size = len(data)
+                        info.mtime = mtime
+                        tf.addfile(info, io.BytesIO(data))
+            except (tarfile.TarError, OSError) as e:
+                raise CacheException("Error compressing cache") from e
+
+    @property
+    def encryptor(self) -> typing.Optional[AESGCM]:
+        if self._encryptor is None and self.encryption_key is not None:
+            # Derive a dedicated AES-GCM key from the Fernet key material, which is still used to decrypt data written by older versions
+            key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=AESGCM_KEY_INFO).derive(base64.urlsafe_b64decode(self.encryption_key))
+            self._encryptor = AESGCM(key)
+        return self._encryptor
+
+    @property
+    def files(self) -> typing.Dict[str, bytes]:
+        if self._files is None:
+            with self.lock:
+                # Check again under the lock, another thread may have loaded the files while waiting
+                if self._files is None:
+                    self._files = self.load_files()
+        return self._files
+
+    def load_files(self) -> typing.Dict[str, bytes]:
+        """
+        Load and decrypt file data from the cache archive
+        """
+        files = {}
+        try:
+            if FILES_NAME in self.members:
+                files = unpack_files(self.decrypt(self.members[FILES_NAME]))
+
+            # Load files from caches written with a file per key
+            for name in [x for x in self.members.keys() if LEGACY_FILE_EXPR.match(x)]:
+                files[name] = self.decrypt(self.members.pop(name))
+        except (InvalidToken, struct.error) as e:
+            raise CacheException("Error loading cache files") from e
+        return files
 
+    def decrypt(self, data: bytes) -> bytes:
+        if self.encryptor is None:
+            return data
+        try:
+            return self.encryptor.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], None)
+        except InvalidTag:
+            # Fall back to data encrypted with Fernet by older versions
+            return Fernet(self.encryption_key).decrypt(data)
+
+    def encrypt(self, data: bytes) -> bytes:
+        if self.encryptor is None:
+            return data
+        nonce = os.urandom(NONCE_SIZE)
+        return nonce + self.encryptor.encrypt(nonce, data, None)
+
+    def flush(self) -> None:
+        """
+        Write file data to the cache archive members
+        """
+        # File data which was never loaded is unchanged
+        if self._files is None:
+            return
+
+        with self.lock:
+            self.members[FILES_NAME] = self.encrypt(pack_files(self.files))
 
     def get_file(self, key: str) -> typing.List[bytes]:
-        key_hash = hashlib.sha256(key.encode()).hexdigest()
+        key_hash = hash_key(key)
 
-        if os.path.isfile(os.path.join(self.cache_dir, key_hash)):
-            with open(os.path.join(self.cache_dir, key_hash), "rb") as f:
-                data = f.read()
-                if self.encryptor is not None:
-                    data = self.encryptor.decrypt(data)
-                return json.loads(data, object_hook=json_decode)
-        return []
+        data = self.files.get(key_hash)
+        if data is None:
+            return []
+        return json_decoder.decode(data.decode())
 
     def put_file(self, key: str, data: typing.List[bytes]) -> None:
-        key_hash = hashlib.sha256(key.encode()).hexdigest()
-        
-        with open(os.path.join(self.cache_dir, key_hash), "wb") as f:
-            _data = json.dumps(data, default=json_encode).encode()
-            if self.encryptor is not None:
-                _data = self.encryptor.encrypt(_data)
-            f.write(_data)
+        key_hash = hash_key(key)
+        _data = json_encoder.encode(data).encode()
+
+        with self.lock:
+            # Skip file data which is unchanged
+            if self.files.get(key_hash) == _data:
+                return
+            self.files[key_hash] = _data
+            self.dirty = True
 
     def has_entry(self, key: str) -> bool:
-        key_hash = hashlib.sha256(key.encode()).hexdigest()
+        key_hash = hash_key(key)
         return key_hash in self.cache
 
     def get_entry(self, key: str, default: typing.Any=None) -> typing.Any:
-        key_hash = hashlib.sha256(key.encode()).hexdigest()
+        key_hash = hash_key(key)
         return self.cache.get(key_hash, default)
     
     def put_entry(self, key: str, data: typing.Any) -> None:
-        key_hash = hashlib.sha256(key.encode()).hexdigest()
-        self.cache[key_hash] = data
\ No newline at end of file
+        key_hash = hash_key(key)
+        with self.lock:
+            if key_hash not in self.cache or self.cache[key_hash] != data:
+                self.dirty = True
+                self.changes[key_hash] = data
+            self.cache[key_hash] = data
\ No newline at end of file
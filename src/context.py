@@ -6,10 +6,24 @@ from src.template import template_render
 class ContextException(Exception):
     pass
 
+def has_placeholder(value: typing.Any) -> bool:
+    """
+    Determine whether a value contains any strings which may require template expansion
+    """
+    if isinstance(value, str):
+        return "{" in value
+    elif isinstance(value, list):
+        return any(has_placeholder(x) for x in value)
+    elif isinstance(value, dict):
+        return any(has_placeholder(k) or has_placeholder(v) for k, v in value.items())
+    return False
+
 class Context:
     def __init__(self):
         self.frames = [{"_frameId" : "root"}]
         self._variables = {}
+        # Frames containing each pushed variable, in frame order, so lookups avoid scanning every frame
+        self._lookup = {}
 
     def keys(self):
         keys = set(self._variables.keys())
@@ -25,6 +39,11 @@ class Context:
 
     def pop_frame(self, id: str | None=None) -> None:
         frame = self.frames.pop()
+        for key in frame.keys():
+            if key in self._lookup:
+                self._lookup[key].pop()
+                if len(self._lookup[key]) == 0:
+                    del self._lookup[key]
         if frame["_frameId"] != id:
             raise ContextException(f"Stack frames do not match up {id} != {frame['id']}")
 
@@ -32,6 +51,8 @@ class Context:
         if len(self.frames) == 0:
             raise ContextException("No context frame to push to")
         
+        if key not in self.frames[-1]:
+            self._lookup.setdefault(key, []).append(self.frames[-1])
         self.frames[-1].setdefault(key, []).append(value)
 
     def pop_variable(self, key: str) -> typing.Any:
@@ -41,6 +62,9 @@ class Context:
         v = self.frames[-1][key].pop()
         if len(self.frames[-1][key]) == 0:
             del self.frames[-1][key]
+            self._lookup[key].pop()
+            if len(self._lookup[key]) == 0:
+                del self._lookup[key]
         return v
 
     def set_variable(self, key: str, value: typing.Any) -> None:
@@ -50,17 +74,25 @@ class Context:
         """
         Get the most recent value of a variable from the context
         """
-        for frame in self.frames:
-            if key in frame:
-                return frame[key][-1]
+        if key in self._lookup:
+            # The earliest frame containing the variable takes precedence
+            return self._lookup[key][0][key][-1]
         return self._variables.get(key, default)
 
     def expand_context(self, value: typing.Any) -> typing.Any:
         if isinstance(value, str):
             if "{" in value:
                 return template_render(value, self)
-        elif isinstance(value, list):
-            return [self.expand_context(x) for x in value]
-        elif isinstance(value, dict):
-            return {self.expand_context(k) : self.expand_context(v) for k, v in value.items()}
-        return value
\ No newline at end of file
+            return value
+        elif not isinstance(value, (list, dict)) or not has_placeholder(value):
+            # Skip rebuilding static structures
+            return value
+
+        # Bind the recursive call locally, avoiding an attribute lookup per item
+        expand = self.expand_context
+        if isinstance(value, list):
+            return [expand(x) for x in value]
+        if any(isinstance(k, str) and "{" in k for k in value.keys()):
+            return {expand(k) : expand(v) for k, v in value.items()}
+        # Only values require expansion
+        return {k : expand(v) for k, v in value.items()}
\ No newline at end of file
@@ -1,6 +1,8 @@
 from __future__ import annotations
+import collections
 import hashlib
 import logging
+import threading
 import typing
 import types
 
@@ -46,27 +48,58 @@ def type_choice(options: typing.List[typing.Any], default: typing.Any=None, thro
     
     return inner
 
+class HashToken(bytes):
+    """
+    Structural token emitted by `hash_args`, distinguishing it from argument values of type bytes
+    """
+    pass
+
+LIST_START, LIST_END, DICT_START, DICT_END, KEY_SEP, ITEM_SEP = [HashToken(x) for x in [b'[', b']', b'{', b'}', b':', b',']]
+
 def hash_args(arg: object, hash: object=None, skip_keys: typing.List[bytes]=[]) -> object:
     if hash is None:
         hash = hashlib.sha256()
-    if isinstance(arg, list):
-        hash.update(b'[')
-        [(hash_args(x, hash, skip_keys), hash.update(b',')) for x in arg]
-        hash.update(b']')
-    elif isinstance(arg, dict):
-        hash.update(b'{')
-        [(hash_args(k, hash, skip_keys), hash.update(b':'), hash_args(v, hash, skip_keys), hash.update(b',')) for k, v in arg.items() if not k in skip_keys]
-        hash.update(b'}')
-    else:
-        hash.update(b's')
-        hash.update(str(arg).encode())
+
+    # Serialize the argument iteratively into a single buffer, hashing it with one update call rather than one per token
+    buf = bytearray()
+    stack = [arg]
+    while len(stack) > 0:
+        x = stack.pop()
+        if isinstance(x, HashToken):
+            buf += x
+        elif isinstance(x, list):
+            buf += LIST_START
+            stack.append(LIST_END)
+            for v in reversed(x):
+                stack.append(ITEM_SEP)
+                stack.append(v)
+        elif isinstance(x, dict):
+            buf += DICT_START
+            stack.append(DICT_END)
+            for k, v in reversed([(k, v) for k, v in x.items() if not k in skip_keys]):
+                stack.append(ITEM_SEP)
+                stack.append(v)
+                stack.append(KEY_SEP)
+                stack.append(k)
+        else:
+            buf += b's'
+            buf += str(x).encode()
+    hash.update(buf)
     return hash
 
 def all_subclasses(cls):
-    return set(cls.__subclasses__()).union([s for c in cls.__subclasses__() for s in all_subclasses(c)])
+    subclasses = set()
+    queue = collections.deque([cls])
+    while len(queue) > 0:
+        for subcls in queue.popleft().__subclasses__():
+            if not subcls in subclasses:
+                subclasses.add(subcls)
+                queue.append(subcls)
+    return subclasses
 
-_loadables = set()
 _classes = {}
+# Serializes class preparation, so no caller observes a partially prepared class
+_prepare_lock = threading.Lock()
 
 class Loadable:
     @classmethod
@@ -82,8 +115,9 @@ class Loadable:
             ltype =  kwargs["type"]
         else:
             # If a `type` hint isnt provided, assume the type is in the first key that is not in the tope level class `type_determination_skip` list
+            cls.prepare()
             for x in kwargs.keys():
-                if not x in getattr(cls, "type_determination_skip", []):
+                if not x in cls.type_determination_skip_set:
                     ltype = x
                     break
 
@@ -95,9 +129,17 @@ class Loadable:
 
     @classmethod
     def prepare(cls) -> None:
-        if not cls.__name__ in _loadables:
-            _loadables.add(cls.__name__)
+        # Check the class's own namespace, as subclasses would otherwise inherit the flag from a prepared parent
+        if cls.__dict__.get("_prepared", False):
+            return
+
+        with _prepare_lock:
+            # Check again under the lock, another thread may have prepared the class while waiting
+            if cls.__dict__.get("_prepared", False):
+                return
+
             cls.loadable_type = cls.__name__.lower()
+            cls.type_determination_skip_set = frozenset(getattr(cls, "type_determination_skip", []))
 
             for subcls in all_subclasses(cls):
                 subcls.loadable_name = subcls.__name__.replace(cls.__name__, "").lower()
@@ -111,21 +153,30 @@ class Loadable:
                 }
 
                 # Traverse down the class inheritence stack merging any found `keys` dictionaries
-                for x in subcls.__mro__[::-1]:
-                    subcls.loadable_keys = {**subcls.loadable_keys, **getattr(x, "keys", {})}
-            
+                for x in reversed(subcls.__mro__):
+                    subcls.loadable_keys.update(getattr(x, "keys", {}))
+        
                 # Check no reserved names are used in the discovered class keys
                 for k in subcls.loadable_keys.keys():
                     if k in RESERVED_KEYS:
                         raise LoadableException(f"Loadable {cls.__name__} uses reserved key '{k}'")
 
+                # Normalize the key definitions once, rather than on every load
+                subcls.loadable_specs = []
+                for k, v in subcls.loadable_keys.items():
+                    ktype, kdefault = v if isinstance(v, tuple) else (type(v), v)
+                    subcls.loadable_specs.append((k, ktype, kdefault, isinstance(ktype, types.FunctionType), isinstance(kdefault, (type, types.FunctionType))))
+
+            # Only mark the class as prepared once every subclass has been registered
+            cls._prepared = True
+
     @classmethod
     def load(cls, **kwargs) -> Loadable:
         cls.prepare()
 
         # Discern the loadable type
         loadable_cls = cls.get_type(kwargs)
-        logger.debug(f"Loading {cls.__name__} type {loadable_cls}")
+        logger.debug("Loading %s type %s", cls.__name__, loadable_cls)
 
         # If the `type` hint was used in kwargs, remove it
         if "type" in kwargs:
@@ -139,15 +190,14 @@ class Loadable:
 
         # Initialise loadable kwargs
         lkwargs = {}
-        for k, v in loadable_cls.loadable_keys.items():
+        for k, ktype, kdefault, ktype_function, kdefault_callable in loadable_cls.loadable_specs:
             # TODO: Required vars
-            ktype, kdefault = v if isinstance(v, tuple) else (type(v), v)
             if k in kwargs:
                 # Cast as the correct type
                 if ktype is None:
                     raise LoadableException(f"Unexpected argument '{k}'")
                 
-                if isinstance(ktype, types.FunctionType):
+                if ktype_function:
                     # Exceptions raised it ktype will bubble
                     lkwargs[k] = ktype(kwargs[k])
                 else:
@@ -163,9 +213,7 @@ class Loadable:
                 del kwargs[k]
             else:
                 # If the default is a callable, call it
-                if isinstance(kdefault, (type, types.FunctionType)):
-                    kdefault = kdefault()
-                lkwargs[k] = kdefault
+                lkwargs[k] = kdefault() if kdefault_callable else kdefault
 
         # Assign remaining kwargs to a kwargs key
         lkwargs["kwargs"] = kwargs
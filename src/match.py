@@ -1,16 +1,18 @@
-import hashlib
 import logging
+import operator
 import re
 import typing
 
 from src.loadable import Loadable, type_none_or_type
 from src.context import Context
 from src.cache import Cache
-from src.template import template_render
+from src.template import template_is_literal, template_render
 from src.selector import SelectorItem
 
 logger = logging.getLogger(__name__)
 
+COND_EXPR = re.compile(r"(?:(.*)\s+)?(eq|==|neq|!=|lt|<|lte|<=|gt|>|gte|>=)\s+(.*)")
+
 class MatchException(Exception):
     pass
 
@@ -32,18 +34,19 @@ class CacheMatch(Match):
     def match(self, ctx: Context, data: typing.List[bytes]) -> bool:
         if not self.empty:
             if len(data) == 0:
-                logger.debug(f"CacheMatch: Empty data, returning False")
+                logger.debug("CacheMatch: Empty data, returning False")
                 return False
 
         cache: Cache = ctx.get_variable("cache")
 
         hash_key = ctx.expand_context(self.key) if self.key is not None else f"{self.hash}-match"
-        logger.debug(f"{self.__class__.__name__}: cache key {hash_key}")
-        if not cache.has_entry(hash_key):
-            cache.put_entry(hash_key, True)
-            logger.debug(f"CacheMatch: Cache miss, returning True")
-            return True
-        logger.debug(f"CacheMatch: Cache hit, returning False")
+        logger.debug("%s: cache key %s", self.__class__.__name__, hash_key)
+        with cache.lock:
+            if not cache.has_entry(hash_key):
+                cache.put_entry(hash_key, True)
+                logger.debug("CacheMatch: Cache miss, returning True")
+                return True
+        logger.debug("CacheMatch: Cache hit, returning False")
         return False
 
 class CondMatch(Match):
@@ -54,11 +57,12 @@ class CondMatch(Match):
     }
     default_key = "value"
     operators = {"eq" : "eq", "==" : "eq", "neq" : "neq", "!=" : "neq", "lt" : "lt", "<" : "lt", "lte" : "lte", "<=" : "lte", "gt" : "gt", ">" : "gt", "gte" : "gte", ">=" : "gte"}
+    comparisons = {"eq" : operator.eq, "neq" : operator.ne, "lt" : operator.lt, "lte" : operator.le, "gt" : operator.gt, "gte" : operator.ge}
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-        m = re.match("(?:(.*)\s+)?(eq|==|neq|!=|lt|<|lte|<=|gt|>|gte|>=)\s+(.*)", self.value)
+        m = COND_EXPR.match(self.value)
         if m is not None:
             self.comparitor, self.operator, self.value = m.groups()
             self.comparitor = self.comparitor or self.keys["comparitor"][1]
@@ -66,37 +70,47 @@ class CondMatch(Match):
         self.operator = self.operators.get(self.operator)
         if self.operator is None:
             raise MatchException(f"Unknown operator '{self.operator}")
+        self.compare = self.comparisons[self.operator]
+
+        self.ordered = self.operator not in ["eq", "neq"]
+
+        # Literal operands are compared as is rather than rendered on every match
+        self.comparitor_operand = self.literal_operand(self.comparitor)
+        self.value_operand = self.literal_operand(self.value)
+
+    def literal_operand(self, operand: str) -> typing.Any:
+        """
+        Return a literal operand, pre-cast as an integer for ordered comparisons, or None if the operand must be rendered
+        """
+        if not template_is_literal(operand):
+            return None
+        if self.ordered:
+            try:
+                return int(operand)
+            except ValueError:
+                # Raised when matching
+                pass
+        return operand
 
     def match(self, ctx: Context, items: typing.List[SelectorItem]) -> bool:
         if len(items) != 1:
             raise MatchException("CondMatch can only operate on one item")
         
         item = items[0]
-        c1 = template_render(self.comparitor, ctx, data=item.value)
-        c2 = template_render(self.value, ctx, data=item.value)
+        c1 = self.comparitor_operand if self.comparitor_operand is not None else template_render(self.comparitor, ctx, data=item.value)
+        c2 = self.value_operand if self.value_operand is not None else template_render(self.value, ctx, data=item.value)
 
-        logger.debug(f"CondMatch: {self.comparitor} {self.operator} {self.value}")
-        logger.debug(f"CondMatch: {c1} {self.operator} {c2}")
+        logger.debug("CondMatch: %s %s %s", self.comparitor, self.operator, self.value)
+        logger.debug("CondMatch: %s %s %s", c1, self.operator, c2)
         logger.debug(ctx.frames)
 
-        if self.operator not in ["eq", "neq"]:
+        if self.ordered:
             try:
                 c1 = int(c1)
                 c2 = int(c2)
             except (TypeError, ValueError):
                 raise MatchException("Less than and Greater than comparisons can only be performed on integer values")
-        
-        if self.operator == "lt":
-            return c1 < c2
-        elif self.operator == "lte":
-            return c1 <= c2
-        elif self.operator == "gt":
-            return c1 > c2
-        elif self.operator == "gte":
-            return c1 >= c2
-        elif self.operator == "neq":
-            return c1 != c2
-        return c1 == c2
+        return self.compare(c1, c2)
 
 class NoneMatch(Match):
     """
@@ -1,13 +1,19 @@
 from __future__ import annotations
+import concurrent.futures
+import functools
 import hashlib
 import html
-import json
 import logging
 import re
+import threading
 import typing
 
 import jq
-from bs4 import BeautifulSoup
+import lxml.html
+from cssselect import GenericTranslator, HTMLTranslator
+from cssselect.parser import Element
+from cssselect.xpath import XPathExpr
+from lxml import etree
 
 from src.cache import Cache
 from src.context import Context
@@ -15,6 +21,29 @@ from src.loadable import Loadable, type_none_or_type, type_list_of_type
 
 logger = logging.getLogger(__name__)
 
+# Match runs of adjacent tags at once, reducing the number of substitutions. The leading literal `<` lets the regex engine skip ahead to each candidate tag
+TAGS_EXPR = re.compile(rb'<[^>]+>(?:<[^>]+>)*')
+LINE_TAGS_EXPR = re.compile(rb'<(br\s*/|/p)>')
+# Minimum number of items for parallelizable selectors to use the thread pool
+PARALLEL_THRESHOLD = 4
+# Values shorter than this are memoized when decoded, as short fragments commonly recur across items
+DECODE_CACHE_LIMIT = 1024
+
+
+# Selectors are loaded afresh for every watch execution, so memoize compiling their expressions
+@functools.lru_cache(maxsize=256)
+def compile_regex(regex: str) -> re.Pattern:
+    return re.compile(regex.encode())
+
+@functools.lru_cache(maxsize=256)
+def compile_jq(program: str) -> jq._Program:
+    return jq.compile(program)
+
+@functools.lru_cache(maxsize=256)
+def compile_css(css: str, xml: bool=False) -> etree.XPath:
+    # XML documents match element names regardless of namespace, HTML documents use the HTML translation rules
+    translator = XmlTranslator() if xml else HTMLTranslator()
+    return etree.XPath(translator.css_to_xpath(css))
 
 class SelectorException(Exception):
     pass
@@ -23,6 +52,7 @@ class SelectorItem():
     def __init__(self, value:bytes, vars:typing.Optional[dict]=None):
         self.value:bytes = value
         self.vars:dict = vars or dict()
+        self._hash:typing.Optional[int] = None
 
     def clone(self, value:typing.Optional[bytes]=None, vars:typing.Optional[dict]={}) -> SelectorItem:
         return SelectorItem(value or self.value, {**self.vars, **vars})
@@ -38,14 +68,20 @@ class SelectorItem():
         return f"<SelectorItem value={repr(self.value)}, vars={repr(self.vars)}>"
     
     def __hash__(self) -> int:
-        hash_value = hash(self.__class__.__name__)
-        hash_value ^= hash(self.value)
-        for k, v in self.vars.items():
-            hash_value ^= hash(k) ^ hash(v)
-        return hash_value
+        # Items are not modified after construction, so compute the hash once on first use
+        if self._hash is None:
+            hash_value = hash(self.__class__.__name__)
+            hash_value ^= hash(self.value)
+            for k, v in self.vars.items():
+                hash_value ^= hash(k) ^ hash(v)
+            self._hash = hash_value
+        return self._hash
     
     def __eq__(self, other:SelectorItem) -> bool:
-        return hash(self) == hash(other)
+        if not isinstance(other, SelectorItem):
+            return NotImplemented
+        # Compare the hashes first as a cheap inequality check, then the contents so hash collisions do not compare equal
+        return hash(self) == hash(other) and self.value == other.value and self.vars == other.vars
 
 class Selector(Loadable):
     default_key = "value"
@@ -54,17 +90,31 @@ class Selector(Loadable):
         "input" : (type_none_or_type(str), None), # The variable to use as input overriding the original data
         "store" : (type_none_or_type(str), None), # Store the result in a variable and pass through the original data
     }
+    # Whether the selector implements `run_batch`, for selectors whose results depend only on the item value
+    batchable = False
 
     def run(self, ctx: Context, item:SelectorItem) -> typing.List[SelectorItem]:
+        if self.batchable:
+            return [item.clone(x) for x in self.run_batch([item.value])[0]]
+        raise Exception("Not Implemented")
+
+    def run_batch(self, values:typing.List[bytes]) -> typing.List[typing.List[bytes]]:
+        """
+        Run over a flat list of item values, returning the list of result values for each value
+        """
         raise Exception("Not Implemented")
 
     def run_all(self, ctx: Context, items:typing.List[SelectorItem]) -> typing.List[SelectorItem]:
+        if self.batchable:
+            # Process the values as a single batch, then rebuild the items from the results
+            return [item.clone(x) for item, values in zip(items, self.run_batch([x.value for x in items])) for x in values]
+
         # Run the modifier over each datum recording the result
         _data = []
+        extend = _data.extend
+        run = self.run
         for datum in items:
-            result = self.run(ctx, datum)
-            if len(result) > 0:
-                _data.extend(result)
+            extend(run(ctx, datum))
         return _data
     
     # API contract for all selectors
@@ -78,18 +128,18 @@ class Selector(Loadable):
         results = self.run_all(ctx, _data)
 
         # Ensure correct typing from the selectors
-        if not isinstance(results, list) or any([not isinstance(x, SelectorItem) for x in results]):
+        if not isinstance(results, list) or not all(isinstance(x, SelectorItem) for x in results):
             raise SelectorException(f"Invalid result from {self.__class__.__name__}: {results}")
         
         # Debug print the result
-        if logger.level <= logging.DEBUG:
+        if logger.isEnabledFor(logging.DEBUG):
             _result = "<empty>"
             if len(results):
                 try:
                     _result = "".join(["\n\t" + repr(x) for x in results])
                 except UnicodeDecodeError:
                     _result = "\n\t" + repr(results)
-            logger.debug(f"{self.__class__.__name__}: output: {_result}")
+            logger.debug("%s: output: %s", self.__class__.__name__, _result)
 
         if self.store is not None:
             ctx.push_variable(self.store, results)
@@ -117,7 +167,7 @@ class SubSelector(Selector):
             _items.extend(item)
             
         # Ensure correct typing from the sub selectors
-        if any([not isinstance(x, SelectorItem) for x in _items]):
+        if not all(isinstance(x, SelectorItem) for x in _items):
             raise SelectorException(f"Invalid result from {self.__class__.__name__}: {_items}")
         return _items
 
@@ -128,9 +178,13 @@ class RegexSelector(Selector):
         "all" : (bool, False)
     }
 
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pattern = compile_regex(self.regex)
+
     def run(self, ctx: Context, item:SelectorItem) -> typing.List[SelectorItem]:
         results = []
-        for m in re.finditer(self.regex.encode(), item.value):
+        for m in self.pattern.finditer(item.value):
             # If named groups are used add the values to data.vars
             if m.groupdict():
                 results.append(item.clone(m.group(), m.groupdict()))
@@ -146,10 +200,14 @@ class RegexSelector(Selector):
         return results
 
 class JqSelector(Selector):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.program = compile_jq(self.value)
+
     def run(self, ctx: Context, item:SelectorItem) -> typing.List[SelectorItem]:
-        j = json.loads(item.value)
         results = []
-        for line in jq.compile(self.value).input(j).all():
+        # Hand jq the raw JSON text to parse in C, rather than building the Python object graph with json.loads first
+        for line in self.program.input_text(item.value.decode()).all():
             if isinstance(line, str):
                 results.append(item.clone(line.encode()))
             else:
@@ -158,15 +216,96 @@ class JqSelector(Selector):
                 results.append(item.clone(vars=vars))
         return results
 
-class HTMLSelector(Selector):
-    def run(self, ctx: Context, item:SelectorItem) -> typing.List[SelectorItem]:
-        soup = BeautifulSoup(item.value, "html.parser")
-        return [item.clone(str(x).encode()) for x in soup.select(self.value)]
+executor = None
+executor_lock = threading.Lock()
+def init_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global executor
+    if executor is None:
+        with executor_lock:
+            # Check again under the lock, so concurrent watch files share a single pool
+            if executor is None:
+                executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="selector")
+    return executor
+
+class LxmlSelector(Selector):
+    """
+    Base for selectors which parse items with lxml. As lxml releases the GIL while parsing, larger batches of items are parsed in parallel
+    """
+
+    def parse(self, value: bytes) -> typing.Optional[etree._Element]:
+        raise Exception("Not Implemented")
+
+    def serialize(self, element: etree._Element) -> bytes:
+        return etree.tostring(element, encoding="unicode", with_tail=False).encode()
+
+    def select(self, item: SelectorItem, tree: typing.Optional[etree._Element]) -> typing.List[SelectorItem]:
+        if tree is None:
+            return []
+        return [item.clone(self.serialize(x)) for x in self.xpath(tree)]
 
-class XmlSelector(Selector):
     def run(self, ctx: Context, item:SelectorItem) -> typing.List[SelectorItem]:
-        soup = BeautifulSoup(item.value, "lxml-xml")
-        return [item.clone(str(x).encode()) for x in soup.select(self.value)]
+        return self.select(item, self.parse(item.value))
+
+    def run_all(self, ctx: Context, items:typing.List[SelectorItem]) -> typing.List[SelectorItem]:
+        if len(items) < PARALLEL_THRESHOLD:
+            return super().run_all(ctx, items)
+
+        # Only parsing is run in the thread pool, selection and serialization happen on the calling thread
+        _data = []
+        for item, tree in zip(items, init_executor().map(self.parse, [x.value for x in items])):
+            _data.extend(self.select(item, tree))
+        return _data
+
+class HTMLSelector(LxmlSelector):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Translate the CSS selector to a compiled XPath expression once, rather than on every item
+        self.xpath = compile_css(self.value)
+
+    def parse(self, value: bytes) -> typing.Optional[etree._Element]:
+        try:
+            # Parse utf-8 documents as text, lxml otherwise assumes latin-1 for bytes without a declared encoding
+            return etree.HTML(value.decode())
+        except (UnicodeDecodeError, ValueError):
+            return etree.HTML(value)
+
+    def serialize(self, element: etree._Element) -> bytes:
+        return lxml.html.tostring(element, encoding="unicode", with_tail=False).encode()
+
+class XmlTranslator(GenericTranslator):
+    """
+    Translate CSS selectors for XML documents, matching unprefixed element names in any namespace
+    """
+
+    def xpath_element(self, selector: Element) -> XPathExpr:
+        if selector.element and selector.namespace is None:
+            xpath = XPathExpr(element="*")
+            xpath.add_condition(f"local-name() = {self.xpath_literal(selector.element)}")
+            return xpath
+        return super().xpath_element(selector)
+
+class XmlSelector(LxmlSelector):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.xpath = compile_css(self.value, xml=True)
+
+    def parse(self, value: bytes) -> typing.Optional[etree._Element]:
+        try:
+            # Recover from malformed documents and never resolve external entities. A parser is created per document as parsers must not be shared between threads
+            return etree.fromstring(value, etree.XMLParser(recover=True, resolve_entities=False))
+        except etree.XMLSyntaxError:
+            return None
+
+@functools.lru_cache(maxsize=4096)
+def html_unescape_cached(value: bytes) -> bytes:
+    return html.unescape(value.decode()).encode()
+
+def html_unescape(value: bytes) -> bytes:
+    if b'&' not in value:
+        return value
+    if len(value) < DECODE_CACHE_LIMIT:
+        return html_unescape_cached(value)
+    return html.unescape(value.decode()).encode()
 
 class DecodeSelector(Selector):
     default_key = "encoding"
@@ -177,7 +316,7 @@ class DecodeSelector(Selector):
 
     def run(self, ctx: Context, item:SelectorItem) -> typing.List[SelectorItem]:
         if self.encoding == self.ENCODING_HTML:
-            return [item.clone(html.unescape(item.value.decode()).encode())]
+            return [item.clone(html_unescape(item.value))]
         raise Exception(f"Unknown encoding {self.encoding}")
 
 class BytesSelector(Selector):
@@ -186,9 +325,11 @@ class BytesSelector(Selector):
         "start" : (int, 0),
         "end" : (int, None)
     }
+    batchable = True
 
-    def run(self, ctx: Context, item:SelectorItem) -> typing.List[SelectorItem]:
-        return [item.clone(item.value[self.start:self.end])]
+    def run_batch(self, values:typing.List[bytes]) -> typing.List[typing.List[bytes]]:
+        start, end = self.start, self.end
+        return [[x[start:end]] for x in values]
 
 class LinesSelector(Selector):
     keys = {
@@ -198,8 +339,9 @@ class LinesSelector(Selector):
 
     def run(self, ctx: Context, item:SelectorItem) -> typing.List[SelectorItem]:
         value = item.value
-        if html:
-            value = re.sub(b'<(br\s*/|/p)>', b'<\\1>\n', value)
+        # Only run the substitution over values which may contain line breaking tags
+        if self.html and (b'<br' in value or b'</p' in value):
+            value = LINE_TAGS_EXPR.sub(b'<\\1>\n', value)
             
         return [item.clone(x) for x in value.splitlines(keepends=self.keepends)]
 
@@ -212,10 +354,17 @@ class SplitSelector(Selector):
         "start" : (int, 0),
         "end" : (int, None)
     }
+    batchable = True
 
-    def run(self, ctx: Context, item:SelectorItem) -> typing.List[SelectorItem]:
-        bsep = self.sep.encode()
-        return [item.clone(x) for x in item.value.split(bsep)[self.start:self.end]]
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.bsep = self.sep.encode()
+        # When slicing from the start with a positive end, only split as far as needed
+        self.maxsplit = self.end if self.end is not None and self.start >= 0 and self.end >= 0 else -1
+
+    def run_batch(self, values:typing.List[bytes]) -> typing.List[typing.List[bytes]]:
+        bsep, maxsplit, start, end = self.bsep, self.maxsplit, self.start, self.end
+        return [x.split(bsep, maxsplit)[start:end] for x in values]
 
 class JoinSelector(Selector):
     """
@@ -225,12 +374,16 @@ class JoinSelector(Selector):
     keys = {
         "sep" : (str, ",")
     }
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.bsep = self.sep.encode()
     
     def run_all(self, ctx: Context, items:typing.List[SelectorItem]) -> typing.List[SelectorItem]:
         if len(items) == 0:
             return []
         # Clone the first item in data and join the remaining item values
-        return [items[0].clone(self.sep.encode().join([x.value for x in items]))]
+        return [items[0].clone(self.bsep.join([x.value for x in items]))]
 
 class StripSelector(Selector):
     """
@@ -240,17 +393,25 @@ class StripSelector(Selector):
     keys = {
         "chars" : (str, "\r\n\t "),
     }
+    batchable = True
 
-    def run(self, ctx: Context, item:SelectorItem) -> typing.List[SelectorItem]:
-        return [item.clone(item.value.strip(self.chars.encode()))]
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.bchars = self.chars.encode()
+
+    def run_batch(self, values:typing.List[bytes]) -> typing.List[typing.List[bytes]]:
+        bchars = self.bchars
+        return [[x.strip(bchars)] for x in values]
 
 class StripTagsSelector(Selector):
     """
     Strip HTML tags from a byte string
     """
+    batchable = True
 
-    def run(self, ctx: Context, item:SelectorItem) -> typing.List[SelectorItem]:
-        return [item.clone(re.sub(b'<[^>]+>', b'', item.value))]
+    def run_batch(self, values:typing.List[bytes]) -> typing.List[typing.List[bytes]]:
+        sub = TAGS_EXPR.sub
+        return [[sub(b'', x)] for x in values]
 
 class ReplaceSelector(Selector):
     """
@@ -261,9 +422,16 @@ class ReplaceSelector(Selector):
         "regex" : (str, ".*"),
         "replacement" : (str, "")
     }
+    batchable = True
 
-    def run(self, ctx: Context, item:SelectorItem) -> typing.List[SelectorItem]:
-        return [item.clone(re.sub(self.regex.encode(), self.replacement.encode(), item.value))]
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pattern = compile_regex(self.regex)
+        self.breplacement = self.replacement.encode()
+
+    def run_batch(self, values:typing.List[bytes]) -> typing.List[typing.List[bytes]]:
+        sub, breplacement = self.pattern.sub, self.breplacement
+        return [[sub(breplacement, x)] for x in values]
 
 class SliceSelector(Selector):
     """
@@ -287,10 +455,19 @@ class PickSelector(Selector):
         "index" : (type_list_of_type(int), [])
     }
 
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.index_set = frozenset(self.index)
+        self.max_index = max(self.index, default=-1)
+
     def run_all(self, ctx: Context, items:typing.List[SelectorItem]) -> typing.List[SelectorItem]:
-        if len(items) == 0:
-            return []
-        return [x for i, x in enumerate(items) if i in self.index]
+        results = []
+        index_set = self.index_set
+        # Stop at the highest picked index rather than scanning the whole list
+        for i, x in enumerate(items[:self.max_index + 1]):
+            if i in index_set:
+                results.append(x)
+        return results
 
 
 class FormatSelector(Selector):
@@ -319,10 +496,28 @@ class CacheSelector(Selector):
     }
     type = None
 
-    def get_cached_data(self, ctx: Context) -> typing.Any:
+    def execute(self, ctx: Context, data:typing.List[SelectorItem]) -> typing.List[SelectorItem]:
+        # Hold the cache lock across the read-modify-write of the cached data, as watch files may be processed concurrently
+        cache: Cache = ctx.get_variable("cache")
+        with cache.lock:
+            return super().execute(ctx, data)
+
+    def get_cache_key(self, ctx: Context) -> str:
+        return ctx.expand_context(self.cache_key) if self.cache_key is not None else f"{self.hash}-selector-cache-{self.__class__.__name__.lower()}"
+
+    def get_item_key(self, item: SelectorItem) -> str:
+        """
+        Get the key identifying an item, from the `key` var if set or otherwise a hash of the item value
+        """
+        key = item.vars.get(self.key)
+        if key is None:
+            # Only hash the value when there is no key var
+            return hashlib.sha256(item.value).hexdigest()
+        return key.decode() if isinstance(key, bytes) else key
+
+    def get_cached_data(self, ctx: Context, hash_key: str) -> typing.Any:
         cache: Cache = ctx.get_variable("cache")
-        hash_key = ctx.expand_context(self.cache_key) if self.cache_key is not None else f"{self.hash}-selector-cache-{self.__class__.__name__.lower()}"
-        logger.debug(f"{self.__class__.__name__} get_cached_values: cache key {hash_key}")
+        logger.debug("%s get_cached_values: cache key %s", self.__class__.__name__, hash_key)
 
         # Return the cached file cast as type or a default value for the CacheSelector type
         data = cache.get_file(hash_key)
@@ -332,30 +527,35 @@ class CacheSelector(Selector):
             return data
         return self.type() if callable(self.type) else None
     
-    def put_cached_data(self, ctx: Context, data: typing.Any) -> None:
+    def put_cached_data(self, ctx: Context, hash_key: str, data: typing.Any) -> None:
         cache: Cache = ctx.get_variable("cache")
-        hash_key = ctx.expand_context(self.cache_key) if self.cache_key is not None else f"{self.hash}-selector-cache-{self.__class__.__name__.lower()}"
-        logger.debug(f"{self.__class__.__name__} put_cached_values: cache key {hash_key}")
+        logger.debug("%s put_cached_values: cache key %s", self.__class__.__name__, hash_key)
         cache.put_file(hash_key, data)
 
 class NewSelector(CacheSelector):
     """
     Select new items from a list of SelectorItems that is not in the cache
     """
-    type = set
+    type = list
 
     def run_all(self, ctx: Context, items:typing.List[SelectorItem]) -> typing.List[SelectorItem]:
-        cached_set = self.get_cached_data(ctx)
+        hash_key = self.get_cache_key(ctx)
+        cached_keys = self.get_cached_data(ctx, hash_key)
+        cached_set = set(cached_keys)
 
         # Iterate instead of `difference` to preserve order
         new_items = []
         for item in items:
-            key = item.vars.get(self.key, hashlib.sha256(item.value).hexdigest().encode()).decode()
+            key = self.get_item_key(item)
             if not key in cached_set:
                 new_items.append(item)
                 cached_set.add(key)
+                # Append new keys so the stored list keeps the order items were first seen in
+                cached_keys.append(key)
         
-        self.put_cached_data(ctx, list(cached_set))
+        # Skip serializing the unchanged cached keys when there are no new items
+        if len(new_items) > 0:
+            self.put_cached_data(ctx, hash_key, cached_keys)
         return new_items
 
 class SinceSelector(CacheSelector):
@@ -365,18 +565,17 @@ class SinceSelector(CacheSelector):
 
     def run_all(self, ctx: Context, items:typing.List[SelectorItem]) -> typing.List[SelectorItem]:
         index = None
-        last_key = self.get_cached_data(ctx)
+        hash_key = self.get_cache_key(ctx)
+        last_key = self.get_cached_data(ctx, hash_key)
         if last_key is not None:
             for i, item in enumerate(items):
-                key = item.vars.get(self.key, hashlib.sha256(item.value).hexdigest())
-                if key == last_key:
+                if self.get_item_key(item) == last_key:
                     index = i
                     break
         
         _items = items[:index]
         if len(_items) > 0:
-            key = _items[0].vars.get(self.key, hashlib.sha256(_items[0].value).hexdigest().encode()).decode()
-            self.put_cached_data(ctx, key)
+            self.put_cached_data(ctx, hash_key, self.get_item_key(_items[0]))
         return _items
 
 class DictstoreSelector(CacheSelector):
@@ -386,11 +585,12 @@ class DictstoreSelector(CacheSelector):
     type = dict
 
     def run_all(self, ctx: Context, items:typing.List[SelectorItem]) -> typing.List[SelectorItem]:
-        cached_dict = self.get_cached_data(ctx)
+        hash_key = self.get_cache_key(ctx)
+        cached_dict = self.get_cached_data(ctx, hash_key)
         for item in items:
-            key = item.vars.get(self.key, hashlib.sha256(item.value).hexdigest().encode()).decode()
+            key = self.get_item_key(item)
             cached_dict[key] = item.encode()
-        self.put_cached_data(ctx, cached_dict)
+        self.put_cached_data(ctx, hash_key, cached_dict)
         return items
     
 class DictloadSelector(CacheSelector):
@@ -403,12 +603,12 @@ class DictloadSelector(CacheSelector):
     type = dict
 
     def run_all(self, ctx: Context, items:typing.List[SelectorItem]) -> typing.List[SelectorItem]:
-        cached_dict = self.get_cached_data(ctx)
+        cached_dict = self.get_cached_data(ctx, self.get_cache_key(ctx))
         results = []
         for item in items:
             if not self.filter:
                 results.append(item)
-            key = item.vars.get(self.key, hashlib.sha256(item.value).hexdigest().encode()).decode()
+            key = self.get_item_key(item)
             if key in cached_dict:
                 if self.filter:
                     results.append(item)
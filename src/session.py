@@ -0,0 +1,42 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_CONNECTIONS = 32
+POOL_MAXSIZE = 32
+# Default (connect, read) timeout in seconds, so a stalled host cannot block a pooled connection indefinitely
+DEFAULT_TIMEOUT = 30
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter applying a default timeout to requests which do not specify one
+    """
+
+    def __init__(self, *args, timeout: float=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request: requests.PreparedRequest, timeout: float=None, **kwargs) -> requests.Response:
+        return super().send(request, timeout=timeout if timeout is not None else self.timeout, **kwargs)
+
+def new_session(timeout: float=DEFAULT_TIMEOUT) -> requests.Session:
+    """
+    Create a requests session with a connection pool sized for watch fan-out, allowing keep-alive connections to be reused across requests to the same host
+    """
+    s = requests.Session()
+    adapter = TimeoutHTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, timeout=timeout)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+session = None
+session_lock = threading.Lock()
+def init_session() -> requests.Session:
+    global session
+    if session is None:
+        with session_lock:
+            # Check again under the lock, so concurrent watch files share a single pooled session
+            if session is None:
+                session = new_session()
+    return session
@@ -1,9 +1,10 @@
 import base64
+import functools
 import json
 import time
 import typing
 
-from jinja2 import Environment, BaseLoader
+from jinja2 import Environment, BaseLoader, Template
 
 env = None
 def init_env() -> Environment:
@@ -35,8 +36,21 @@ def finalize(value: typing.Any) -> typing.Any:
             return ""
     return value
 
+def template_is_literal(template: str) -> bool:
+    """
+    Determine whether a template string renders to itself, all template syntax starts with "{" and a single trailing newline is stripped when rendering
+    """
+    return "{" not in template and not template.endswith("\n")
+
+@functools.lru_cache(maxsize=1024)
+def template_compile(template: str) -> Template:
+    """
+    Compile a template string, memoized as the same templates are rendered for every watch execution
+    """
+    return init_env().from_string(template)
+
 def template_render(template: str, *args, **kwargs) -> str:
-    _template = init_env().from_string(template)
+    _template = template_compile(template)
     
     _args = {
         "unixtime" : int(time.time())
@@ -13,6 +13,7 @@ from src.context import Context
 from src.loadable import Loadable, LoadableException, type_one_of, type_none_or_type, type_list_of_type, type_choice
 from src.match import Match
 from src.selector import Selector, SelectorItem
+from src.session import DEFAULT_TIMEOUT, new_session
 
 logger = logging.getLogger(__name__)
 
@@ -69,7 +70,7 @@ class Watch(Loadable):
         Entrypoint into an individual (potentially nested) watch.
         Returns a tuple of (action_trigger, action_comment, action_data) with `action_trigger` True if the action_data of the Watch should be reported, False otherwise
         """
-        logger.debug(f"{self.__class__.__name__}: process enter")
+        logger.debug("%s: process enter", self.__class__.__name__)
 
         # Push a new frame into the context
         ctx.push_frame(self.hash)
@@ -83,7 +84,7 @@ class Watch(Loadable):
             
             trigger, comment, data = self.run(ctx)
         except:
-            logger.debug(f"{self.__class__.__name__}: process exception")
+            logger.debug("%s: process exception", self.__class__.__name__)
             raise
         finally:
             # Execute the `after` step within the finally block to ensure it is always executed
@@ -98,7 +99,7 @@ class Watch(Loadable):
             # Pop the frame from the context clearing all context variables
             ctx.pop_frame(self.hash)
         
-        logger.debug(f"{self.__class__.__name__}: process exit triggered {trigger}")
+        logger.debug("%s: process exit triggered %s", self.__class__.__name__, trigger)
         if not trigger:
             return False, [], []
         return trigger, comment, data
@@ -125,8 +126,9 @@ class Watch(Loadable):
             trigger, comment, data = self.process(ctx)
         except:
             # Cache the failure count
-            failure_count = cache.get_entry(f"{self.hash}-failures")
-            cache.put_entry(f"{self.hash}-failures", failure_count + 1)
+            with cache.lock:
+                failure_count = cache.get_entry(f"{self.hash}-failures", 0)
+                cache.put_entry(f"{self.hash}-failures", failure_count + 1)
             
             if ctx["config"].get("verbose") == True:
                 logger.exception(f"{self.hash}:{int(time.time() - starttime):04}:Error:{failure_count}")
@@ -270,7 +272,7 @@ class MultipleWatch(Watch):
         trigger = False
         _trigger = False
 
-        logger.debug(f"{self.__class__.__name__}: run enter")
+        logger.debug("%s: run enter", self.__class__.__name__)
         for watch in self.gen(ctx):
             self.watches.append(watch)
             _trigger, _comment, _data = watch.process(ctx)
@@ -285,11 +287,11 @@ class MultipleWatch(Watch):
                 comment.extend(_comment)
                 data.extend(_data)
                 if self.operator == MultipleWatch.OPERATOR_FIRST:
-                    logger.debug(f"{self.__class__.__name__}: run break first")
+                    logger.debug("%s: run break first", self.__class__.__name__)
                     break
             else:
                 if self.operator == MultipleWatch.OPERATOR_BREAK:
-                    logger.debug(f"{self.__class__.__name__}: run break")
+                    logger.debug("%s: run break", self.__class__.__name__)
                     break
 
         if self.operator == MultipleWatch.OPERATOR_LAST:
@@ -300,10 +302,12 @@ class MultipleWatch(Watch):
         if self.comment is not None:
             comment = [*self.get_comment(ctx), comment]
 
-        logger.debug(f"{self.__class__.__name__}: run exit triggered {trigger}")
+        logger.debug("%s: run exit triggered %s", self.__class__.__name__, trigger)
         return trigger, comment, data
 
 class UrlWatch(DataWatch):
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
     keys = {
         # "url" : str,
         "method" : (str, "GET"),
@@ -312,17 +316,34 @@ class UrlWatch(DataWatch):
         "body" : (type_none_or_type(str), None), 
         "code" : (type_none_or_type(int), None),
         "download" : (type_none_or_type(str), None),
-        "verify" : (bool, True)
+        "verify" : (bool, True),
+        "revalidate" : (bool, False), # Cache the response and conditionally request the URL using the ETag and Last-Modified response headers
+        "timeout" : (type_one_of(int, float), DEFAULT_TIMEOUT)
     }
+    # Changing the timeout or revalidation should not cause a watch to trigger, and keeps hashes stable for watches written before these keys existed
+    hash_skip = Watch.hash_skip + ["timeout", "revalidate"]
     template_variables = ["url", "headers", "body", "cookies"]
 
+    @classmethod
+    def unchanged(cls, validators: dict, r: requests.Response) -> bool:
+        """
+        Determine whether a full response is unchanged from a cached response, for servers which do not support conditional requests
+        """
+        if r.status_code != validators["status_code"]:
+            return False
+        if validators.get("last_modified") is None or validators.get("content_length") is None:
+            return False
+        return r.headers.get("Last-Modified") == validators["last_modified"] \
+            and r.headers.get("Content-Length") == validators["content_length"] \
+            and r.headers.get("ETag") == validators.get("etag")
+
     def fetch_data(self, ctx: Context) -> typing.List[bytes]:
         ctx.push_variable("URL", self.url)
 
         # Use a per-context session for URL watches
         s = ctx.get_variable("requests_session")
         if s is None:
-            s = requests.session()
+            s = new_session()
             ctx.set_variable("requests_session", s)
         
         if len(self.cookies) > 0:
@@ -333,30 +354,69 @@ class UrlWatch(DataWatch):
         # Filter empty header values
         headers = {k : str(v).strip() for k, v in self.headers.items() if v is not None and len(str(v).strip()) > 0}
 
+        # Send the validators of a previously cached response, allowing an unchanged response body to be served from the cache
+        cache: Cache = ctx.get_variable("cache")
+        revalidate_key = f"{self.hash}-revalidate-{self.url}"
+        validators = None
+        if self.revalidate and self.download is None:
+            validators = cache.get_entry(revalidate_key)
+            cached = cache.get_file(revalidate_key) if validators is not None else []
+            if len(cached) == 0:
+                validators = None
+            else:
+                if validators.get("etag") is not None:
+                    headers.setdefault("If-None-Match", validators["etag"])
+                if validators.get("last_modified") is not None:
+                    headers.setdefault("If-Modified-Since", validators["last_modified"])
+
         r = s.request(
             self.method,
             self.url,
             headers=headers,
             data=self.body,
-            stream=True if self.download is not None else False,
-            verify=self.verify)
+            # Defer reading the body of revalidated responses, as it may not be required
+            stream=True if self.download is not None or validators is not None else False,
+            verify=self.verify,
+            timeout=self.timeout)
         
-        logger.debug(f"UrlWatch: [{r.status_code} {r.reason}] {self.url}")
-        if self.code is not None and r.status_code != self.code:
-            raise WatchFetchException(f"Status code {r.status_code} != {self.code}")
+        status_code = r.status_code
+        content = None
+        if validators is not None and (r.status_code == 304 or self.unchanged(validators, r)):
+            logger.debug("UrlWatch: [%s %s] %s using cached response", r.status_code, r.reason, self.url)
+            r.close()
+            status_code = validators["status_code"]
+            content = cached[0]
+        else:
+            logger.debug("UrlWatch: [%s %s] %s", r.status_code, r.reason, self.url)
+
+        if self.code is not None and status_code != self.code:
+            raise WatchFetchException(f"Status code {status_code} != {self.code}")
         
-        ctx.push_variable("status_code", r.status_code)
+        ctx.push_variable("status_code", status_code)
+
+        if self.revalidate and self.download is None and content is None:
+            etag = r.headers.get("ETag")
+            last_modified = r.headers.get("Last-Modified")
+            if etag is not None or last_modified is not None:
+                cache.put_entry(revalidate_key, {
+                    "etag" : etag,
+                    "last_modified" : last_modified,
+                    "content_length" : r.headers.get("Content-Length"),
+                    "status_code" : r.status_code
+                })
+                cache.put_file(revalidate_key, [r.content])
 
         if self.download is not None:
-            location = os.path.abspath(os.path.join(os.getcwd(), self.download))
-            if not location.startswith(os.getcwd() + "/"):
+            base_dir = ctx.get_variable("tmpdir") or os.getcwd()
+            location = os.path.abspath(os.path.join(base_dir, self.download))
+            if not location.startswith(base_dir + "/"):
                 raise WatchFetchException(f"Invalid download path '{self.download}'")
             with open(location, "wb") as f:
-                for chunk in r.iter_content(chunk_size=8192):
+                for chunk in r.iter_content(chunk_size=UrlWatch.DOWNLOAD_CHUNK_SIZE):
                     f.write(chunk)
             return [location.encode()]
         
-        return [r.content]
+        return [content if content is not None else r.content]
     
 
 class CmdWatch(DataWatch):
@@ -376,7 +436,7 @@ class CmdWatch(DataWatch):
         if self.sudo:
             shell = ["sudo"] + shell
 
-        logger.debug(f"CmdWatch: Executing command: {self.cmd}")
+        logger.debug("CmdWatch: Executing command: %s", self.cmd)
         try:
             p = subprocess.Popen(
                 shell, 
@@ -385,7 +445,7 @@ class CmdWatch(DataWatch):
                 stdout=subprocess.PIPE, 
                 stderr=subprocess.PIPE,
                 env={**os.environ, **self.env},
-                cwd=self.cwd
+                cwd=os.path.join(ctx.get_variable("tmpdir") or os.getcwd(), self.cwd)
             )
             stdout, stderr = p.communicate(self.cmd.encode(), timeout=int(self.timeout) if self.timeout is not None else None)
         except subprocess.TimeoutExpired as e:
@@ -395,13 +455,13 @@ class CmdWatch(DataWatch):
                 os.killpg(os.getpgid(p.pid), signal.SIGTERM)
             raise WatchFetchException(f"CmdWatch: Command timeout after {self.timeout} seconds") from e
 
-        logger.debug(f"CmdWatch: Return code: {p.returncode}")
+        logger.debug("CmdWatch: Return code: %s", p.returncode)
         _stdout = ("\n\t" + "\n\t".join(stdout.decode().splitlines()) if len(stdout) else "").strip()
         if len(_stdout):
-            logger.debug(f"CmdWatch: Stdout: {_stdout}")
+            logger.debug("CmdWatch: Stdout: %s", _stdout)
         _stderr = ("\n\t" + "\n\t".join(stderr.decode().splitlines()) if len(stderr) else "").strip()
         if len(_stderr):
-            logger.debug(f"CmdWatch: Stderr: {_stderr}")
+            logger.debug("CmdWatch: Stderr: %s", _stderr)
         if self.return_code is not None and p.returncode != self.return_code:
             raise WatchFetchException(f"CmdWatch: Return code {p.returncode} != {self.return_code}\nStdout:{_stdout}\nStderr:{_stderr}")
 
@@ -477,7 +537,7 @@ class OnceWatch(MultipleWatch):
         cache = ctx.get_variable("cache")
         
         hash_key = ctx.expand_context(self.key) if self.key is not None else f"{self.hash}-once"
-        logger.debug(f"{self.__class__.__name__}: cache key {hash_key}")
+        logger.debug("%s: cache key %s", self.__class__.__name__, hash_key)
         if cache.has_entry(hash_key):
             return False, [], []
 
@@ -0,0 +1,19 @@
+import unittest
+
+from src.context import Context
+from src.selector import Selector, SelectorItem
+
+class TestDecodeSelector(unittest.TestCase):
+    def test_html(self):
+        s: Selector = Selector.load(type="decode", encoding="html")
+        ctx = Context()
+
+        for _ in range(2):
+            result = s.run(ctx, SelectorItem('caf&eacute; &amp; cake'.encode()))
+            self.assertEqual(result[0].value, 'café & cake'.encode())
+
+        result = s.run(ctx, SelectorItem(b'plain'))
+        self.assertEqual(result[0].value, b'plain')
+
+        result = s.run(ctx, SelectorItem(b'&lt;' * 1024))
+        self.assertEqual(result[0].value, b'<' * 1024)
@@ -0,0 +1,39 @@
+import unittest
+
+from src.context import Context
+from src.selector import Selector, SelectorItem
+
+class TestHTMLSelector(unittest.TestCase):
+    def test_1(self):
+        s: Selector = Selector.load(type="html", value="div.a > a")
+        item = SelectorItem(b'<html><body><div class="a"><p>text</p><a href="/1">one</a><a href="/2">two</a></div><a href="/3">three</a></body></html>')
+
+        ctx = Context()
+        result = s.run(ctx, item)
+        self.assertListEqual([x.value for x in result], [b'<a href="/1">one</a>', b'<a href="/2">two</a>'])
+
+    def test_unclosed(self):
+        s: Selector = Selector.load(type="html", value="li")
+        item = SelectorItem(b'<ul><li>1<li>2</ul>')
+
+        ctx = Context()
+        result = s.run(ctx, item)
+        self.assertListEqual([x.value for x in result], [b'<li>1</li>', b'<li>2</li>'])
+
+    def test_encoding(self):
+        s: Selector = Selector.load(type="html", value="p")
+        ctx = Context()
+
+        result = s.run(ctx, SelectorItem('<p>café &amp; cake</p>'.encode()))
+        self.assertListEqual([x.value for x in result], ['<p>café &amp; cake</p>'.encode()])
+
+        result = s.run(ctx, SelectorItem(b''))
+        self.assertListEqual(result, [])
+
+    def test_run_all(self):
+        s: Selector = Selector.load(type="html", value="a")
+        items = [SelectorItem(f'<a href="/{i}">{i}</a><p>{i}</p>'.encode()) for i in range(8)]
+
+        ctx = Context()
+        result = s.run_all(ctx, items)
+        self.assertListEqual([x.value for x in result], [f'<a href="/{i}">{i}</a>'.encode() for i in range(8)])
@@ -0,0 +1,23 @@
+import unittest
+
+from src.context import Context
+from src.selector import Selector, SelectorItem
+
+class TestJqSelector(unittest.TestCase):
+    def test_1(self):
+        s: Selector = Selector.load(type="jq", value=".items[]")
+        ctx = Context()
+
+        # The compiled program is reused across items
+        result = s.run(ctx, SelectorItem(b'{"items": ["a", "b"]}'))
+        self.assertListEqual([x.value for x in result], [b'a', b'b'])
+        result = s.run(ctx, SelectorItem(b'{"items": ["c"]}'))
+        self.assertListEqual([x.value for x in result], [b'c'])
+
+    def test_vars(self):
+        s: Selector = Selector.load(type="jq", value=".item")
+        item = SelectorItem(b'{"item": {"key": 1}}')
+
+        ctx = Context()
+        result = s.run(ctx, item)
+        self.assertDictEqual(result[0].vars, {"key": b'1'})
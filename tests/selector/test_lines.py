@@ -0,0 +1,21 @@
+import unittest
+
+from src.context import Context
+from src.selector import Selector, SelectorItem
+
+class TestLinesSelector(unittest.TestCase):
+    def test_1(self):
+        s: Selector = Selector.load(type="lines")
+        item = SelectorItem(b'1\n2<br/>3\n')
+
+        ctx = Context()
+        result = s.run(ctx, item)
+        self.assertListEqual([x.value for x in result], [b'1', b'2<br/>3'])
+
+    def test_html(self):
+        s: Selector = Selector.load(type="lines", html=True)
+        item = SelectorItem(b'<p>1</p><p>2<br />3</p>')
+
+        ctx = Context()
+        result = s.run(ctx, item)
+        self.assertListEqual([x.value for x in result], [b'<p>1</p>', b'<p>2<br />', b'3</p>'])
@@ -42,4 +42,11 @@ class TestNewSelector(unittest.TestCase):
         result = s.run_all(self.ctx, [items[2], items[3]])
         self.assertListEqual(result, [])
         self.assertSetEqual(set(self.cache.get_file("test_no_new")), set([hashlib.sha256(x.value).hexdigest() for x in items]))
-        
\ No newline at end of file
+        
+    def test_order(self):
+        s: Selector = Selector.load(type="new", cache_key="test_order")
+        items = [SelectorItem(b'4'), SelectorItem(b'2'), SelectorItem(b'3'), SelectorItem(b'1')]
+
+        s.run_all(self.ctx, [items[0], items[1]])
+        s.run_all(self.ctx, [items[1], items[2], items[3], items[2]])
+        self.assertListEqual(self.cache.get_file("test_order"), [hashlib.sha256(x.value).hexdigest() for x in items])
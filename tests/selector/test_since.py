@@ -39,4 +39,12 @@ class TestSinceSelector(unittest.TestCase):
         result = s.run_all(self.ctx, items)
         self.assertListEqual(result, [])
         self.assertEqual(self.cache.get_file("test_no_new"), hashlib.sha256(b'1').hexdigest())
-        
\ No newline at end of file
+        
+    def test_key_var(self):
+        s: Selector = Selector.load(type="since", cache_key="test_key_var")
+        items = [SelectorItem(b'1', {"key": b'a'}), SelectorItem(b'2', {"key": b'b'}), SelectorItem(b'3', {"key": b'c'})]
+
+        s.run_all(self.ctx, [items[1], items[2]])
+        result = s.run_all(self.ctx, items)
+        self.assertListEqual(result, [items[0]])
+        self.assertEqual(self.cache.get_file("test_key_var"), "a")
@@ -19,3 +19,11 @@ class TestSplitSelector(unittest.TestCase):
         ctx = Context()
         result = s.run(ctx, item)
         self.assertEqual(result[-1].vars, item.vars)
+
+    def test_slice(self):
+        item = SelectorItem(b'1,2,3,4')
+        ctx = Context()
+        for start, end in [(0, 2), (1, 3), (0, 0), (2, 10), (0, -1), (-2, None), (1, None)]:
+            s: Selector = Selector.load(type="split", sep=",", start=start, **({"end" : end} if end is not None else {}))
+            result = s.run(ctx, item)
+            self.assertListEqual([x.value for x in result], b'1,2,3,4'.split(b',')[start:end])
@@ -11,3 +11,12 @@ class TestStripSelector(unittest.TestCase):
         ctx = Context()
         result = s.run(ctx, item)
         self.assertEqual(result[0].value, b'test')
+
+    def test_run_all(self):
+        s: Selector = Selector.load(type="strip")
+        items = [SelectorItem(b' a ', {"i": b"1"}), SelectorItem(b'\tb\n', {"i": b"2"})]
+
+        ctx = Context()
+        result = s.run_all(ctx, items)
+        self.assertListEqual([x.value for x in result], [b'a', b'b'])
+        self.assertListEqual([x.vars for x in result], [{"i": b"1"}, {"i": b"2"}])
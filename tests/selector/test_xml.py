@@ -0,0 +1,28 @@
+import unittest
+
+from src.context import Context
+from src.selector import Selector, SelectorItem
+
+class TestXmlSelector(unittest.TestCase):
+    def test_1(self):
+        s: Selector = Selector.load(type="xml", value="item > title")
+        item = SelectorItem(b'<?xml version="1.0" encoding="utf-8"?><rss><channel><title>Feed</title><item><title>One &amp; Two</title></item><item><title>Three</title></item></channel></rss>')
+
+        ctx = Context()
+        result = s.run(ctx, item)
+        self.assertListEqual([x.value for x in result], [b'<title>One &amp; Two</title>', b'<title>Three</title>'])
+
+    def test_namespace(self):
+        # Unprefixed element names match elements in any namespace
+        s: Selector = Selector.load(type="xml", value="entry > title")
+        item = SelectorItem(b'<feed xmlns="http://www.w3.org/2005/Atom"><entry><title>One</title></entry></feed>')
+
+        ctx = Context()
+        result = s.run(ctx, item)
+        self.assertListEqual([x.value for x in result], [b'<title xmlns="http://www.w3.org/2005/Atom">One</title>'])
+
+    def test_empty(self):
+        s: Selector = Selector.load(type="xml", value="title")
+
+        ctx = Context()
+        self.assertListEqual(s.run(ctx, SelectorItem(b'')), [])
@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.action import Action, substitute
+from src.context import Context
+
+class TestRenderAction(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.ctx = Context()
+        self.ctx.set_variable("base_dir", self.tmpdir.name)
+        self.ctx.set_variable("config", {})
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def read(self, name: str) -> list:
+        with open(os.path.join(self.tmpdir.name, "data", f"{name}.json")) as f:
+            return json.load(f)
+
+    def test_merge(self):
+        a: Action = Action.load(render="test_merge")
+        a.report(self.ctx, {"data" : [{"id" : "1", "v" : "a"}, {"id" : "2", "v" : "b"}]})
+        a.report(self.ctx, {"data" : [{"id" : "2", "v" : "c"}, {"id" : "3", "v" : "d"}, {"id" : "3", "v" : "e"}]})
+
+        self.assertListEqual(self.read("test_merge"), [
+            {"id" : "1", "v" : "a"},
+            {"id" : "2", "v" : "c"},
+            {"id" : "3", "v" : "e"},
+        ])
+
+    def test_sort(self):
+        a: Action = Action.load(render="test_sort", sort=["b", "a"])
+        a.report(self.ctx, {"data" : [
+            {"id" : "1", "a" : 2, "b" : 1},
+            {"id" : "2", "a" : 1, "b" : 2},
+            {"id" : "3", "a" : 1, "b" : 1},
+        ]})
+
+        self.assertListEqual([x["id"] for x in self.read("test_sort")], ["3", "2", "1"])
+
+class TestSubstitute(unittest.TestCase):
+    def test_substitute(self):
+        payload = {"text" : "MESSAGE", "blocks" : [{"type" : "section", "text" : "Alert: MESSAGE"}, 1, None], "MESSAGE" : True}
+        self.assertDictEqual(substitute(payload, "MESSAGE", "a \"quoted\"\nmessage"), {
+            "text" : "a \"quoted\"\nmessage",
+            "blocks" : [{"type" : "section", "text" : "Alert: a \"quoted\"\nmessage"}, 1, None],
+            "a \"quoted\"\nmessage" : True
+        })
+        self.assertDictEqual(payload["blocks"][0], {"type" : "section", "text" : "Alert: MESSAGE"})
@@ -1,16 +1,22 @@
+import base64
 import hashlib
+import io
 import os
 import random
+import tarfile
 import unittest
 
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 from src.cache import Cache
 
 class TestCache(unittest.TestCase):
     def setUp(self) -> None:
         rndname = "".join(random.choices("0123456789abcdef", k=12))
-        self.cache = Cache(cache_path=f"/tmp/{rndname}.tar.gz", encryption_key=Fernet.generate_key())
+        self.key = Fernet.generate_key()
+        self.cache = Cache(cache_path=f"/tmp/{rndname}.tar.gz", encryption_key=self.key)
         self.cache.put_entry("entrykey", "data")
         self.cache.put_file("filekey", b'data')
     
@@ -26,8 +32,124 @@ class TestCache(unittest.TestCase):
         self.assertEqual(self.cache.get_file("filekey"), b'data')
 
     def test_file_encryption(self):
-        with open(os.path.join(self.cache.cache_dir, hashlib.sha256("filekey".encode()).hexdigest()), "rb") as f:
-            data = f.read()
+        self.cache.flush()
+        data = self.cache.members["files"]
         
         self.assertEqual(self.cache.get_file("filekey"), b'data')
-        self.assertNotEqual(data, b'data')
+        self.assertNotIn(hashlib.sha256("filekey".encode()).hexdigest().encode(), data)
+        self.assertNotIn(b'_base64', data)
+
+    def test_encryption_key(self):
+        # The AES-GCM key is derived from, rather than equal to, the Fernet key material
+        data = self.cache.encrypt(b'data')
+        with self.assertRaises(InvalidTag):
+            AESGCM(base64.urlsafe_b64decode(self.key)).decrypt(data[:12], data[12:], None)
+        self.assertEqual(self.cache.decrypt(data), b'data')
+
+    def test_legacy_encryption(self):
+        # File data was previously encrypted with Fernet
+        self.assertEqual(self.cache.decrypt(Fernet(self.key).encrypt(b'legacy')), b'legacy')
+
+    def test_persist(self):
+        self.cache.close()
+
+        cache = Cache(cache_path=self.cache.cache_path, encryption_key=self.key)
+        self.assertEqual(cache.get_entry("entrykey"), "data")
+        self.assertEqual(cache.get_file("filekey"), b'data')
+        cache.close()
+
+    def test_unchanged(self):
+        self.cache.close()
+        mtime = os.stat(self.cache.cache_path).st_mtime_ns
+
+        cache = Cache(cache_path=self.cache.cache_path, encryption_key=self.key)
+        cache.put_entry("entrykey", "data")
+        cache.put_file("filekey", cache.get_file("filekey"))
+        self.assertFalse(cache.dirty)
+        cache.close()
+        self.assertEqual(os.stat(self.cache.cache_path).st_mtime_ns, mtime)
+
+        cache = Cache(cache_path=self.cache.cache_path, encryption_key=self.key)
+        cache.put_entry("entrykey", "changed")
+        self.assertTrue(cache.dirty)
+        cache.close()
+
+        cache = Cache(cache_path=self.cache.cache_path, encryption_key=self.key)
+        self.assertEqual(cache.get_entry("entrykey"), "changed")
+        cache.close()
+
+    def test_lazy_files(self):
+        self.cache.close()
+
+        # Entry only access should not decrypt file data
+        cache = Cache(cache_path=self.cache.cache_path, encryption_key=self.key)
+        cache.put_entry("entrykey", "changed")
+        cache.close()
+        self.assertIsNone(cache._encryptor)
+
+        cache = Cache(cache_path=self.cache.cache_path, encryption_key=self.key)
+        self.assertEqual(cache.get_entry("entrykey"), "changed")
+        self.assertEqual(cache.get_file("filekey"), b'data')
+        cache.close()
+
+    def test_changes_log(self):
+        for i in range(4):
+            self.cache.put_entry(f"entrykey{i}", i)
+        self.cache.close()
+
+        # A small change is appended to the changes log, leaving the snapshot untouched
+        cache = Cache(cache_path=self.cache.cache_path, encryption_key=self.key)
+        cache.put_entry("entrykey", "changed")
+        cache.close()
+        with tarfile.open(self.cache.cache_path, "r:gz") as tf:
+            self.assertIn("./changes.log", tf.getnames())
+
+        cache = Cache(cache_path=self.cache.cache_path, encryption_key=self.key)
+        self.assertEqual(cache.get_entry("entrykey"), "changed")
+        self.assertEqual(cache.get_entry("entrykey3"), 3)
+
+        # Once the changes log outgrows the snapshot it is compacted into a new snapshot
+        for i in range(10):
+            cache.put_entry(f"entrykey{i}", "compacted")
+        cache.close()
+        with tarfile.open(self.cache.cache_path, "r:gz") as tf:
+            self.assertNotIn("./changes.log", tf.getnames())
+
+        cache = Cache(cache_path=self.cache.cache_path, encryption_key=self.key)
+        self.assertEqual(cache.get_entry("entrykey"), "changed")
+        self.assertEqual(cache.get_entry("entrykey9"), "compacted")
+        cache.close()
+
+    def test_legacy_snapshot(self):
+        # Caches were previously written with a yaml manifest
+        self.cache.close()
+        with tarfile.open(self.cache.cache_path, "w:gz") as tf:
+            data = ("%s: legacy\n" % hashlib.sha256("legacykey".encode()).hexdigest()).encode()
+            info = tarfile.TarInfo("./cache.yaml")
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+
+        cache = Cache(cache_path=self.cache.cache_path, encryption_key=self.key)
+        self.assertEqual(cache.get_entry("legacykey"), "legacy")
+        cache.put_entry("legacykey", "changed")
+        cache.close()
+        with tarfile.open(self.cache.cache_path, "r:gz") as tf:
+            self.assertIn("./cache.json", tf.getnames())
+            self.assertNotIn("./cache.yaml", tf.getnames())
+
+        cache = Cache(cache_path=self.cache.cache_path, encryption_key=self.key)
+        self.assertEqual(cache.get_entry("legacykey"), "changed")
+        cache.close()
+
+    def test_legacy_files(self):
+        # Caches were previously written with an individually encrypted file per key
+        self.cache.close()
+        with tarfile.open(self.cache.cache_path, "w:gz") as tf:
+            data = Fernet(self.key).encrypt(b'[{"_base64": true, "data": "bGVnYWN5"}]')
+            info = tarfile.TarInfo("./" + hashlib.sha256("legacykey".encode()).hexdigest())
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+
+        cache = Cache(cache_path=self.cache.cache_path, encryption_key=self.key)
+        self.assertEqual(cache.get_file("legacykey"), [b'legacy'])
+        cache.close()
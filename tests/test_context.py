@@ -40,9 +40,28 @@ class TestContext(unittest.TestCase):
         self.assertListEqual(self.ctx.expand_context(["aaabbb", 123, "x{{STR}}x"]), ["aaabbb", 123, "x123x"])
 
 
+    def test_expand_static(self):
+        value = {"aa" : ["bb", 123, {"cc" : "dd"}]}
+        self.assertIs(self.ctx.expand_context(value), value)
+
     def test_expand_dict(self):
         self.assertDictEqual(self.ctx.expand_context({"aa" : "bb", "cc" : "dd", "ee" : "ff"}), {"aa" : "bb", "cc" : "dd", "ee" : "ff"})
         self.assertDictEqual(self.ctx.expand_context({"a{{STR}}a" : "bb", "cc" : "dd", "ee" : "ff"}), {"a123a" : "bb", "cc" : "dd", "ee" : "ff"})
         self.assertDictEqual(self.ctx.expand_context({"aa" : "b{{STR}}b", "cc" : "dd", "ee" : "ff"}), {"aa" : "b123b", "cc" : "dd", "ee" : "ff"})
         self.assertDictEqual(self.ctx.expand_context({"aa" : "bb", "cc" : "dd", "e{{STR}}e" : "ff"}), {"aa" : "bb", "cc" : "dd", "e123e" : "ff"})
         self.assertDictEqual(self.ctx.expand_context({"aa" : "bb", "cc" : "dd", "ee" : "f{{STR}}f"}), {"aa" : "bb", "cc" : "dd", "ee" : "f123f"})
+
+    def test_frames(self):
+        self.ctx.push_variable("VAR", "root")
+        self.ctx.push_frame("frame")
+        self.ctx.push_variable("VAR", "frame")
+        self.ctx.push_variable("FRAME", "frame")
+        # The earliest frame containing a variable takes precedence
+        self.assertEqual(self.ctx.get_variable("VAR"), "root")
+        self.assertEqual(self.ctx.get_variable("FRAME"), "frame")
+
+        self.ctx.pop_frame("frame")
+        self.assertIsNone(self.ctx.get_variable("FRAME"))
+        self.assertEqual(self.ctx.pop_variable("VAR"), "root")
+        self.assertIsNone(self.ctx.get_variable("VAR"))
+        self.assertEqual(self.ctx.get_variable("STR"), "123")
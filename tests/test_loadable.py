@@ -41,6 +41,15 @@ class SubTypeTest(TypeTest):
     }
     
 
+class Reserved(Loadable):
+    pass
+
+class SubReserved(Reserved):
+    keys = {
+        "kwargs" : (dict, dict)
+    }
+
+
 class TestLoadable(unittest.TestCase):
     def test_1(self):
         o = Loadable1.load(type="Base1", key5=5, key6="6")
@@ -106,3 +115,8 @@ class TestLoadable(unittest.TestCase):
         self.assertEqual(o.__class__, SubTypeTest)
         self.assertEqual(o.sub, "456")
         self.assertEqual(o.before, "789")
+
+    def test_reserved_key(self):
+        # A failed preparation must not leave the class marked as prepared
+        self.assertRaises(LoadableException, lambda: Reserved.load(type="sub"))
+        self.assertRaises(LoadableException, lambda: Reserved.load(type="sub"))
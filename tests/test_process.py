@@ -0,0 +1,67 @@
+import importlib.util
+import os
+import sys
+import tempfile
+import unittest
+
+from src.action import FileLogAction
+from src.cache import Cache
+
+# The entrypoint script shares its name with the tests.watch package, load it by path
+spec = importlib.util.spec_from_file_location("watch_main", os.path.join(os.path.dirname(__file__), "..", "watch.py"))
+watch = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(watch)
+
+
+WATCH_FILE = """
+watch:
+  - range: 5
+    comment: "{name} triggered"
+    selectors:
+      - new: "{name}-new"
+    match:
+      type: cache
+      key: "{name}-match"
+    actions:
+      - filelog: test_process.log
+"""
+
+class TestProcess(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = Cache()
+        self.config = {"default_actions" : [], "data_path" : self.tmpdir.name}
+
+        self.watch_files = []
+        for i in range(32):
+            watch_file = os.path.join(self.tmpdir.name, f"watch{i}.yml")
+            with open(watch_file, "w") as f:
+                f.write(WATCH_FILE.format(name=f"watch{i}"))
+            self.watch_files.append(watch_file)
+
+    def tearDown(self) -> None:
+        logger = FileLogAction.loggers.pop("action.file.test_process.log", None)
+        if logger is not None:
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+                handler.close()
+        self.cache.close()
+        self.tmpdir.cleanup()
+
+    def test_jobs(self):
+        # Switch threads as often as possible to surface races between the workers
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            watch.process(self.config, self.cache, self.watch_files, [], jobs=8)
+        finally:
+            sys.setswitchinterval(interval)
+
+        for i in range(32):
+            self.assertEqual(len(self.cache.get_file(f"watch{i}-new")), 5)
+            self.assertTrue(self.cache.has_entry(f"watch{i}-match"))
+
+        # Every watch logs to the same file, which must only have a single handler
+        self.assertEqual(len(FileLogAction.loggers["action.file.test_process.log"].handlers), 1)
+        with open(os.path.join(self.tmpdir.name, "test_process.log")) as f:
+            self.assertEqual(len(f.read().splitlines()), 32)
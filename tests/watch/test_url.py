@@ -0,0 +1,137 @@
+import http.server
+import threading
+import time
+import unittest
+
+import requests
+
+from src.cache import Cache
+from src.context import Context
+from src.watch import Watch
+
+
+LAST_MODIFIED = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.path == "/slow":
+            time.sleep(1)
+
+        body = b"ok"
+        headers = {}
+        if self.path == "/etag":
+            headers["ETag"] = '"v1"'
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+        elif self.path == "/ignore":
+            # Ignore conditional requests, always responding with the full body
+            body = self.server.body
+            headers["Last-Modified"] = LAST_MODIFIED
+            headers["ETag"] = self.server.etag
+        elif self.path == "/modified":
+            headers["Last-Modified"] = LAST_MODIFIED
+            if self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+                self.send_response(304)
+                self.end_headers()
+                return
+
+        self.send_response(200)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TestUrlWatch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        cls.server.requests = []
+        cls.server.body = b"ok"
+        cls.server.etag = '"v1"'
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self) -> None:
+        self.ctx = Context()
+        self.cache = Cache()
+        self.ctx.set_variable("cache", self.cache)
+        self.server.requests.clear()
+
+    def tearDown(self) -> None:
+        self.cache.close()
+
+    def test_basic(self):
+        w = Watch.load(url=f"{self.url}/")
+        w.process(self.ctx)
+        self.assertEqual(self.ctx["data"][0].value, b'ok')
+
+    def test_timeout(self):
+        w = Watch.load(url=f"{self.url}/slow", timeout=0.1)
+        with self.assertRaises(requests.exceptions.Timeout):
+            w.process(self.ctx)
+
+    def test_revalidate_etag(self):
+        w = Watch.load(url=f"{self.url}/etag", revalidate=True)
+        w.process(self.ctx)
+        self.assertNotIn("If-None-Match", self.server.requests[-1])
+        self.assertEqual(self.cache.get_entry(f"{w.hash}-revalidate-{self.url}/etag")["etag"], '"v1"')
+        self.assertListEqual(self.cache.get_file(f"{w.hash}-revalidate-{self.url}/etag"), [b'ok'])
+
+        w = Watch.load(url=f"{self.url}/etag", revalidate=True)
+        w.process(self.ctx)
+        self.assertEqual(self.server.requests[-1]["If-None-Match"], '"v1"')
+        self.assertEqual(self.ctx["data"][0].value, b'ok')
+
+    def test_revalidate_last_modified(self):
+        w = Watch.load(url=f"{self.url}/modified", revalidate=True)
+        w.process(self.ctx)
+        self.assertNotIn("If-Modified-Since", self.server.requests[-1])
+        self.assertEqual(self.cache.get_entry(f"{w.hash}-revalidate-{self.url}/modified")["last_modified"], LAST_MODIFIED)
+
+        w = Watch.load(url=f"{self.url}/modified", revalidate=True)
+        w.process(self.ctx)
+        self.assertEqual(self.server.requests[-1]["If-Modified-Since"], LAST_MODIFIED)
+        self.assertEqual(self.ctx["data"][0].value, b'ok')
+
+    def test_unchanged(self):
+        kwargs = {"url" : f"{self.url}/ignore", "revalidate" : True, "selectors" : [{"new" : "test_unchanged"}]}
+        self.server.body = b"v1"
+        self.server.etag = '"v1"'
+        trigger, _, _ = Watch.load(**kwargs).process(self.ctx)
+        self.assertTrue(trigger)
+
+        # The same headers mark the response as unchanged, so the changed body is never read
+        self.server.body = b"v2"
+        trigger, _, _ = Watch.load(**kwargs).process(self.ctx)
+        self.assertEqual(self.server.requests[-1]["If-None-Match"], '"v1"')
+        self.assertFalse(trigger)
+        self.assertEqual(self.ctx["data"], [])
+
+        # A changed ETag is processed even with the same Last-Modified and Content-Length
+        self.server.etag = '"v2"'
+        trigger, _, _ = Watch.load(**kwargs).process(self.ctx)
+        self.assertTrue(trigger)
+        self.assertEqual(self.ctx["data"][0].value, b'v2')
+
+    def test_no_revalidate(self):
+        w = Watch.load(url=f"{self.url}/etag")
+        w.process(self.ctx)
+        w.process(self.ctx)
+        self.assertNotIn("If-None-Match", self.server.requests[-1])
+        self.assertIsNone(self.cache.get_entry(f"{w.hash}-revalidate-{self.url}/etag"))
+
+    def test_timeout_hash(self):
+        self.assertEqual(Watch.load(url=f"{self.url}/").hash, Watch.load(url=f"{self.url}/", timeout=5).hash)
+        self.assertEqual(Watch.load(url=f"{self.url}/").hash, Watch.load(url=f"{self.url}/", revalidate=True).hash)
@@ -1,4 +1,5 @@
 import argparse
+import concurrent.futures
 import glob
 import json
 import logging
@@ -7,14 +8,19 @@ import tempfile
 import typing
 import yaml
 
-from src.cache import Cache
+from src.action import Action
+from src.cache import Cache, SafeLoader
 from src.context import Context
+from src.match import Match
+from src.selector import Selector
 from src.watch import Watch, WatchException
 
+logger = logging.getLogger(__name__)
+
 def find(watch_files, hash):
     for watch_file in watch_files:
         with open(watch_file) as f:
-            watch_config = yaml.safe_load(f)
+            watch_config = yaml.load(f, Loader=SafeLoader)
 
         if watch_config is None:
             continue
@@ -26,66 +32,79 @@ def find(watch_files, hash):
                 print(watch_file, json.dumps(watch))
                 return
 
-def process(config: dict, cache: Cache, watch_files: typing.List[str], template_file: typing.List[str]) -> None:
+def process_file(config: dict, cache: Cache, watch_file: str, templates: dict, base_dir: str) -> None:
+    with open(watch_file) as f:
+        watch_config = yaml.load(f, Loader=SafeLoader)
+    if watch_config is None:
+        return
+    
+    ctx = Context()
+    ctx.set_variable("config", config)
+    ctx.set_variable("cache", cache)
+    ctx.set_variable("watch_file", watch_file)
+    ctx.set_variable("base_dir", base_dir)
+    # Load templates into the context
+    ctx.set_variable("templates", {**templates, **watch_config.get("templates", {})})
+     # Load variables into the context
+    for k, v in watch_config.get("variables", {}).items():
+        ctx.set_variable(k, ctx.expand_context(v))
+
+    try:
+        # Watches resolve relative paths against `tmpdir` rather than the process working directory, so watch files can be processed concurrently
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ctx.set_variable("tmpdir", tmpdir)
+
+            # Load an execute any 'before' tasks
+            for before in [Watch.load(**x) for x in watch_config.get("before", [])]:
+                before.process(ctx)
+            
+            # Execute main 'watch' tasks
+            for watch in [Watch.load(**x) for x in watch_config.get("watch", [])]:
+                try:
+                    watch.execute(ctx)
+                except WatchException:
+                    # Early exit out of a watch_file in the event on an exception
+                    break
+            
+            # Load an execute any 'after' tasks
+            for after in [Watch.load(**x) for x in watch_config.get("after", [])]:
+                after.process(ctx)
+    except PermissionError:
+        logger.warning("Error removing temporary directory")
+
+def process(config: dict, cache: Cache, watch_files: typing.List[str], template_files: typing.List[str], jobs: int=1) -> None:
     cwd = os.getcwd()
 
     # Load global templates
     templates = {}
     for template_file in template_files:
         with open(template_file) as f:
-            template_config = yaml.safe_load(f)
+            template_config = yaml.load(f, Loader=SafeLoader)
             templates.update(template_config.get("templates", {}))
 
-    for watch_file in watch_files:
-        with open(watch_file) as f:
-            watch_config = yaml.safe_load(f)
-        if watch_config is None:
-            continue
-        
-        ctx = Context()
-        ctx.set_variable("config", config)
-        ctx.set_variable("cache", cache)
-        ctx.set_variable("watch_file", watch_file)
-        ctx.set_variable("base_dir", cwd)
-        # Load templates into the context
-        ctx.set_variable("templates", {**templates, **watch_config.get("templates", {})})
-         # Load variables into the context
-        for k, v in watch_config.get("variables", {}).items():
-            ctx.set_variable(k, ctx.expand_context(v))
+    if jobs <= 1:
+        for watch_file in watch_files:
+            process_file(config, cache, watch_file, templates, cwd)
+        return
 
-        try:
-            with tempfile.TemporaryDirectory() as tmpdir:
-                os.chdir(tmpdir)
-                ctx.set_variable("tmpdir", tmpdir)
-
-                # Load an execute any 'before' tasks
-                for before in [Watch.load(**x) for x in watch_config.get("before", [])]:
-                    before.process(ctx)
-                
-                # Execute main 'watch' tasks
-                for watch in [Watch.load(**x) for x in watch_config.get("watch", [])]:
-                    try:
-                        watch.execute(ctx)
-                    except WatchException:
-                        # Early exit out of a watch_file in the event on an exception
-                        break
-                
-                # Load an execute any 'after' tasks
-                for after in [Watch.load(**x) for x in watch_config.get("after", [])]:
-                    after.process(ctx)
-        except PermissionError:
-            print(f"Error removing temporary directory\n")
-        finally:
-            os.chdir(cwd)
+    # Register the loadable classes up front, rather than racing to prepare them from the worker threads
+    for loadable in [Watch, Selector, Match, Action]:
+        loadable.prepare()
+
+    # Watch files are independent of each other, overlap their network and subprocess waits on a thread pool
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(process_file, config, cache, watch_file, templates, cwd) for watch_file in watch_files]
+        for future in futures:
+            future.result()
 
 if __name__ == "__main__":
     ch = logging.StreamHandler()
     formatter = logging.Formatter("%(asctime)s %(levelname)8s %(name)s | %(message)s")
     ch.setFormatter(formatter)
 
-    logger = logging.getLogger()
-    logger.addHandler(ch)
-    logger.setLevel(logging.INFO)
+    root_logger = logging.getLogger()
+    root_logger.addHandler(ch)
+    root_logger.setLevel(logging.INFO)
     
     parser = argparse.ArgumentParser()
     parser.add_argument("--cache", "-c", type=str, default="cache.tar.gz")
@@ -94,11 +113,12 @@ if __name__ == "__main__":
     parser.add_argument("--verbose", "-v", action="store_true")
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--test", "-t", action="store_true")
+    parser.add_argument("--jobs", "-j", type=int, default=1)
     parser.add_argument('watches', type=str, nargs=argparse.REMAINDER)
     args = parser.parse_args()
 
     if args.debug:
-        logger.setLevel(logging.DEBUG)
+        root_logger.setLevel(logging.DEBUG)
 
     config = {
         "default_actions" : [{"type" : "log"}],
@@ -107,7 +127,7 @@ if __name__ == "__main__":
     if not (args.test):
         if os.path.isfile(args.config):
             with open(args.config) as f:
-                config = {**config, **yaml.safe_load(f).get("config", {})}
+                config = {**config, **yaml.load(f, Loader=SafeLoader).get("config", {})}
 
     template_files = set()
     watch_files = set()
@@ -121,16 +141,16 @@ if __name__ == "__main__":
             watch_files.update(glob.glob(os.path.join(x, "**/*.y*ml"), recursive=True))
     
     watch_files -= template_files
-    logger.debug(f"Loading watch files: {watch_files}")
-    logger.debug(f"Loading template files: {template_files}")
+    logger.debug("Loading watch files: %s", watch_files)
+    logger.debug("Loading template files: %s", template_files)
 
     if args.find:
         find(watch_files, args.find)
     elif args.test:
-        process(config, Cache(cache_path=None), watch_files, template_files)
+        process(config, Cache(cache_path=None), watch_files, template_files, jobs=args.jobs)
     else:
         cache = Cache(cache_path=args.cache, encryption_key=config.get("key"))
         try:
-            process(config, cache, watch_files, template_files)
+            process(config, cache, watch_files, template_files, jobs=args.jobs)
         finally:
             cache.close()